@@ -0,0 +1,162 @@
+import asyncio
+import collections
+import os
+import time
+from starlette.routing import Match
+from metrics import Counter, Histogram
+
+# Per-route concurrency limits with a bounded wait queue; excess load gets a fast 503
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "false").lower() in ("1", "true", "yes")
+ADMISSION_DEFAULT_LIMIT = int(os.getenv("ADMISSION_DEFAULT_LIMIT", "32"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "250"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+# "METHOD /path/template=limit" pairs, comma-separated; 0 means unlimited. /metrics stays reachable under overload
+ADMISSION_ROUTE_LIMITS = os.getenv("ADMISSION_ROUTE_LIMITS", "GET /metrics=0")
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "admission_wait_seconds",
+    "Time admitted requests spent queued for a concurrency slot",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+ADMISSION_SHED = Counter("admission_shed_total", "Requests rejected with 503 by admission control")
+
+SHED_BODY = b'{"detail":"Server busy, retry later"}'
+
+def parse_route_limits(raw):
+    limits = {}
+    for entry in raw.split(","):
+        if entry.strip():
+            route, _, limit = entry.rpartition("=")
+            limits[" ".join(route.split())] = int(limit)
+    return limits
+
+class Limiter:
+    """Counting semaphore whose waiters queue FIFO up to `queue_size` and give up after a deadline"""
+
+    def __init__(self, limit, queue_size):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters = collections.deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    async def acquire(self, timeout):
+        """(True, None) once a slot is held, or (False, reason) when shed because the queue is full or the wait timed out"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True, None
+        if len(self._waiters) >= self.queue_size:
+            return False, "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            return False, "timeout"
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the client went away
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        return True, None
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self):
+        # Hand the slot straight to the oldest live waiter, so queued requests cannot be overtaken
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+# One limiter per "METHOD /route"; module level because Starlette rebuilds middleware instances
+limiters = {}
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware; limits apply per matched route template"""
+
+    def __init__(self, app, routes, limits=None, default_limit=ADMISSION_DEFAULT_LIMIT, queue_size=ADMISSION_QUEUE_SIZE,
+                 timeout_ms=ADMISSION_QUEUE_TIMEOUT_MS, retry_after=ADMISSION_RETRY_AFTER_SECONDS):
+        self.app = app
+        # The router's own list, so routes included after the middleware is added are seen too
+        self.routes = routes
+        self.limits = parse_route_limits(ADMISSION_ROUTE_LIMITS) if limits is None else limits
+        self.default_limit = default_limit
+        self.queue_size = queue_size
+        self.timeout = timeout_ms / 1000
+        self.retry_after = retry_after
+
+    def _match(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    def limiter_for(self, key):
+        limiter = limiters.get(key)
+        if limiter is None:
+            limit = self.limits.get(key, self.default_limit)
+            if limit <= 0:
+                return None
+            limiter = limiters[key] = Limiter(limit, self.queue_size)
+        return limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self._match(scope)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        key = f'{scope["method"]} {route.path}'
+        limiter = self.limiter_for(key)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        admitted, reason = await limiter.acquire(self.timeout)
+        labels = (("route", key),)
+        if not admitted:
+            ADMISSION_SHED.inc(labels + (("reason", reason),))
+            # Lets the metrics middleware label the 503 with the route that shed it
+            scope["route"] = route
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(SHED_BODY)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": SHED_BODY})
+            return
+        ADMISSION_WAIT_SECONDS.observe(labels, time.perf_counter() - start)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+def render():
+    lines = []
+    for name, attr in (("admission_in_flight", "active"), ("admission_queue_depth", "queued"), ("admission_limit", "limit")):
+        lines.append(f"# TYPE {name} gauge")
+        for key, limiter in sorted(limiters.items()):
+            lines.append(f'{name}{{route="{key}"}} {getattr(limiter, attr)}')
+    return lines + ADMISSION_WAIT_SECONDS.render() + ADMISSION_SHED.render()
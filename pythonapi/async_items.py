@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+from batcher import WRITE_BATCHING, InsertBatcher
+from bulk import insert_batch
+from database import AsyncSessionLocal, get_async_read_db, get_async_write_db
+from fields import requested_fields
+from query_guard import query_budget
+from schemas import ItemCreate, ItemResponse
+import items
+
+# Async versions of the item endpoints, mounted by main.py when DB_ASYNC is set. The logic is
+# items.py's, run through run_sync: the statements are still awaited on the event loop
+router = APIRouter()
+
+async def _flush_inserts(rows):
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(insert_batch, rows)
+
+insert_batcher = InsertBatcher(_flush_inserts) if WRITE_BATCHING else None
+
+@router.post("/items/", response_model=ItemResponse)
+@query_budget(3)
+async def create_item(item: ItemCreate, db: AsyncSession = Depends(get_async_write_db)):
+    if insert_batcher is not None:
+        # Group commit: resolves once the batch holding the row is committed
+        values = item.dict()
+        return {"id": await insert_batcher.submit(values), "version": 1, **values}
+    return await db.run_sync(items.create_item, item)
+
+@router.get("/items/{item_id}", response_model=ItemResponse)
+@query_budget(2)
+async def read_item(
+    item_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[tuple] = Depends(requested_fields),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    return await db.run_sync(items.read_item, item_id, request, response, fields)
+
+@router.get("/items/", response_model=List[ItemResponse])
+@query_budget(items.LIST_QUERY_BUDGET)
+async def read_items(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    sort: Literal["id", "price"] = "id",
+    ids: Optional[str] = None,
+    fields: Optional[tuple] = Depends(requested_fields),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    return await db.run_sync(items.read_items, request, response, skip, limit, cursor, sort, ids, fields)
+
+@router.put("/items/{item_id}", response_model=ItemResponse)
+@query_budget(3)
+async def update_item(item_id: int, item: ItemCreate, request: Request, response: Response, db: AsyncSession = Depends(get_async_write_db)):
+    return await db.run_sync(items.update_item, item_id, item, request, response)
+
+@router.delete("/items/{item_id}")
+@query_budget(2)
+async def delete_item(item_id: int, db: AsyncSession = Depends(get_async_write_db)):
+    return await db.run_sync(items.delete_item, item_id)
@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import os
+
+# Group commit for POST /items/: rows arriving within a few ms share one INSERT and one COMMIT
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "false").lower() in ("1", "true", "yes")
+WRITE_BATCH_MAX_ROWS = int(os.getenv("WRITE_BATCH_MAX_ROWS", "100"))
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "2"))
+
+class InsertBatcher:
+    """Coalesces concurrent single-row inserts into batched transactions.
+
+    `flush_batch(rows)` is a coroutine function that inserts the rows in one
+    transaction and returns their ids in order. If a batch fails, its rows are
+    retried one by one so that only the offending callers see the error.
+    """
+
+    def __init__(self, flush_batch, max_rows=WRITE_BATCH_MAX_ROWS, max_delay_ms=WRITE_BATCH_MAX_DELAY_MS):
+        self.flush_batch = flush_batch
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.batches = 0
+        self.rows = 0
+        self._pending = []
+        self._timer = None
+        self._flush_lock = None
+        self._tasks = set()
+
+    async def submit(self, values):
+        """Queue one row and wait for the id it is assigned when its batch commits"""
+        loop = asyncio.get_running_loop()
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        future = loop.create_future()
+        self._pending.append((values, future))
+        if len(self._pending) >= self.max_rows:
+            self._start_flush()
+        elif self._timer is None:
+            # Flush work is not part of whichever request happened to open the batch
+            self._timer = contextvars.Context().run(loop.call_later, self.max_delay, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        # One flush at a time; rows arriving meanwhile form the next group
+        async with self._flush_lock:
+            rows = [values for values, _ in batch]
+            try:
+                ids = await self.flush_batch(rows)
+            except Exception:
+                await self._flush_one_by_one(batch)
+                return
+            self.batches += 1
+            self.rows += len(rows)
+            for (_, future), item_id in zip(batch, ids):
+                if not future.done():
+                    future.set_result(item_id)
+
+    async def _flush_one_by_one(self, batch):
+        for values, future in batch:
+            try:
+                (item_id,) = await self.flush_batch([values])
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.batches += 1
+                self.rows += 1
+                if not future.done():
+                    future.set_result(item_id)
+
+    async def drain(self):
+        """Flush anything still queued, e.g. at shutdown"""
+        self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_rows": round(self.rows / self.batches, 2) if self.batches else 0,
+        }
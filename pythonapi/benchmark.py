@@ -0,0 +1,961 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the pythonapi item endpoints.
+
+Every scenario boots the app in-process against a throwaway SQLite database
+and drives it through httpx's ASGI transport, so no server or MySQL is needed.
+
+    python benchmark.py async --requests 2000 --concurrency 50
+
+The load scenario reports per-route latency percentiles and can gate on a
+stored run:
+
+    python benchmark.py load --save-baseline baseline.json
+    python benchmark.py load --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = {}
+
+def scenario(func):
+    SCENARIOS[func.__name__[len("bench_"):]] = func
+    return func
+
+def load_app(database_url, **env):
+    """Import main against the given database; settings are read at import time"""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.update(env)
+    import main
+    return main.app
+
+@contextlib.asynccontextmanager
+async def client_for(app):
+    """AsyncClient bound to the app, running its startup and shutdown handlers"""
+    import httpx
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+
+def run_child(name, env, extra_args=()):
+    """Run a scenario in a fresh interpreter so it can use different settings"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), name, *extra_args],
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+async def seed(client, count):
+    ids = []
+    for i in range(count):
+        response = await client.post("/items/", json={"name": f"item-{i}", "description": "seed", "price": i % 100})
+        ids.append(response.json()["id"])
+    return ids
+
+def bulk_seed(count, batch=10000):
+    """Insert synthetic rows straight through the engine, bypassing the API"""
+    from sqlalchemy import insert
+    import database, models
+    with database.engine.begin() as conn:
+        for start in range(0, count, batch):
+            rows = [
+                {"name": f"item-{i}", "description": "seed", "price": (i * 7919) % 1000}
+                for i in range(start, min(start + batch, count))
+            ]
+            conn.execute(insert(models.Item), rows)
+
+async def timed(call, repeat):
+    """Median wall time in ms of `repeat` awaited calls"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def percentile(samples, q):
+    """Nearest-rank percentile of an already sorted list"""
+    return samples[min(len(samples) - 1, max(0, round(q * len(samples)) - 1))] if samples else None
+
+async def drive(worker, requests, concurrency):
+    """Call worker(i) `requests` times from `concurrency` tasks, return elapsed seconds"""
+    counter = iter(range(requests))
+
+    async def loop():
+        for i in counter:
+            await worker(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(loop() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+@scenario
+def bench_crud(args):
+    """Mixed CRUD workload against the current DB_ASYNC setting; prints one JSON line"""
+    async def run():
+        async with client_for(load_app(args.database_url)) as client:
+            ids = await seed(client, 200)
+            rng = random.Random(0)
+
+            async def worker(i):
+                roll = rng.random()
+                if roll < 0.6:
+                    await client.get(f"/items/{rng.choice(ids)}")
+                elif roll < 0.8:
+                    await client.get("/items/", params={"skip": rng.randrange(150), "limit": 50})
+                elif roll < 0.9:
+                    await client.put(f"/items/{rng.choice(ids)}", json={"name": "updated", "price": 1.0})
+                else:
+                    await client.post("/items/", json={"name": f"new-{i}", "price": 2.0})
+
+            elapsed = await drive(worker, args.requests, args.concurrency)
+            return {"requests": args.requests, "seconds": round(elapsed, 3), "rps": round(args.requests / elapsed, 1)}
+
+    print(json.dumps(asyncio.run(run())))
+
+LOAD_MIX = (
+    # (weight, route) for bench_load; ids are drawn from the seeded rows, deletes only hit rows the run created
+    (50, "GET /items/{item_id}"),
+    (15, "GET /items/"),
+    (15, "PUT /items/{item_id}"),
+    (15, "POST /items/"),
+    (5, "DELETE /items/{item_id}"),
+)
+
+def _ms(seconds):
+    # null for a route that drew no requests
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def _load_report(samples, errors, elapsed):
+    routes = {}
+    for route in sorted(samples):
+        latencies = sorted(samples[route])
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": errors.get(route, 0),
+            "rps": round(len(latencies) / elapsed, 1),
+            **{f"p{q}_ms": _ms(percentile(latencies, q / 100)) for q in (50, 95, 99)},
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {"requests": total, "seconds": round(elapsed, 3), "rps": round(total / elapsed, 1), "routes": routes}
+
+def regressions(report, baseline, tolerance):
+    """Human-readable list of ways `report` is worse than `baseline` by more than `tolerance` (0.2 = 20%)"""
+    found = []
+    if report["rps"] < baseline["rps"] * (1 - tolerance):
+        found.append(f"throughput {report['rps']} req/s < baseline {baseline['rps']} req/s")
+    for route, expected in baseline["routes"].items():
+        actual = report["routes"].get(route)
+        if actual is None:
+            found.append(f"{route}: missing from this run")
+            continue
+        if not actual["requests"] or not expected["requests"]:
+            # Too few requests for the mix to reach this route in one of the runs
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if actual[key] > expected[key] * (1 + tolerance):
+                found.append(f"{route}: {key} {actual[key]} > baseline {expected[key]}")
+        if actual["errors"] / actual["requests"] > expected["errors"] / expected["requests"] + 0.01:
+            found.append(f"{route}: {actual['errors']} errors in {actual['requests']} requests")
+    return found
+
+@scenario
+def bench_load(args):
+    """Weighted CRUD mix with per-route p50/p95/p99 and req/s as JSON; --baseline fails the run on regressions"""
+    async def run():
+        app = load_app(args.database_url)
+        bulk_seed(args.seed_rows)
+        async with client_for(app) as client:
+            rng = random.Random(0)
+            routes = [route for _, route in LOAD_MIX]
+            weights = [weight for weight, _ in LOAD_MIX]
+            created = []
+            samples = {route: [] for route in routes}
+            errors = {}
+
+            async def request(route, i):
+                if route == "GET /items/{item_id}":
+                    return await client.get(f"/items/{rng.randrange(1, args.seed_rows + 1)}")
+                if route == "GET /items/":
+                    return await client.get("/items/", params={"skip": rng.randrange(args.seed_rows), "limit": 50})
+                if route == "PUT /items/{item_id}":
+                    item_id = rng.randrange(1, args.seed_rows + 1)
+                    return await client.put(f"/items/{item_id}", json={"name": f"updated-{i}", "price": 1.0})
+                if route == "DELETE /items/{item_id}" and created:
+                    return await client.delete(f"/items/{created.pop(rng.randrange(len(created)))}")
+                response = await client.post("/items/", json={"name": f"load-{i}", "description": "load", "price": 2.0})
+                if response.status_code == 200:
+                    created.append(response.json()["id"])
+                return response
+
+            async def worker(i):
+                route = rng.choices(routes, weights)[0]
+                if route.startswith("DELETE") and not created:
+                    route = "POST /items/"
+                start = time.perf_counter()
+                response = await request(route, i)
+                if i >= args.warmup:
+                    samples[route].append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors[route] = errors.get(route, 0) + 1
+
+            await drive(worker, args.warmup, args.concurrency)
+            counter = iter(range(args.warmup, args.warmup + args.requests))
+            elapsed = await drive(lambda _: worker(next(counter)), args.requests, args.concurrency)
+            return _load_report(samples, errors, elapsed)
+
+    report = asyncio.run(run())
+    print(json.dumps(report))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+@scenario
+def bench_hot_reads(args):
+    """GET /items/{id} over a small hot set with 5% writes; prints one JSON line"""
+    async def run():
+        async with client_for(load_app(args.database_url)) as client:
+            ids = await seed(client, 1000)
+            hot = ids[:50]
+            rng = random.Random(0)
+
+            async def worker(i):
+                item_id = rng.choice(hot)
+                if rng.random() < 0.05:
+                    await client.put(f"/items/{item_id}", json={"name": f"hot-{i}", "price": 3.0})
+                else:
+                    await client.get(f"/items/{item_id}")
+
+            elapsed = await drive(worker, args.requests, args.concurrency)
+            stats = (await client.get("/cache/stats")).json()
+            return {"rps": round(args.requests / elapsed, 1), "cache": stats}
+
+    print(json.dumps(asyncio.run(run())))
+
+@scenario
+def bench_cache(args):
+    """Hot-set read throughput without and with the in-process item cache"""
+    extra = ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    for backend in ("none", "memory"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"DATABASE_URL": f"sqlite:///{tmp}/bench.db", "CACHE_BACKEND": backend}
+            result = run_child("hot_reads", env, extra)
+        cache = result["cache"]
+        print(f"{backend:>7}: {result['rps']:>8} req/s  hits={cache['hits']} misses={cache['misses']} evictions={cache['evictions']}")
+
+@scenario
+def bench_list_pages(args):
+    """CPU time per 1,000-item GET /items/ page under the current FAST_JSON setting; prints one JSON line"""
+    async def run():
+        app = load_app(args.database_url)
+        bulk_seed(5000)
+        async with client_for(app) as client:
+            pages = max(args.requests // 20, 20)
+            await client.get("/items/", params={"limit": 1000})
+            cpu = time.process_time()
+            start = time.perf_counter()
+            for i in range(pages):
+                response = await client.get("/items/", params={"skip": (i % 5) * 1000, "limit": 1000})
+                assert len(response.json()) == 1000
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            return {"pages": pages, "cpu_ms": round(cpu / pages * 1000, 2), "wall_ms": round(elapsed / pages * 1000, 2)}
+
+    print(json.dumps(asyncio.run(run())))
+
+@scenario
+def bench_fast_json(args):
+    """CPU per 1,000-item page: ORM + ItemResponse validation vs. column tuples + orjson"""
+    for enabled in ("false", "true"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"DATABASE_URL": f"sqlite:///{tmp}/bench.db", "FAST_JSON": enabled}
+            result = run_child("list_pages", env, ["--requests", str(args.requests)])
+        print(f"FAST_JSON={enabled:<5}: {result['cpu_ms']:>7} ms CPU/page, {result['wall_ms']:>7} ms wall/page")
+
+@scenario
+def bench_async(args):
+    """Requests/sec of the sync and async item endpoints under the same workload"""
+    extra = ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    for mode in ("false", "true"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"DATABASE_URL": f"sqlite:///{tmp}/bench.db", "DB_ASYNC": mode}
+            result = run_child("crud", env, extra)
+        label = "async" if mode == "true" else "sync"
+        print(f"{label:>6}: {result['rps']:>8} req/s ({result['requests']} requests in {result['seconds']}s)")
+
+@scenario
+def bench_pagination(args):
+    """Latency of OFFSET vs keyset pages as page depth grows"""
+    rows = args.rows
+    limit = 50
+
+    async def run():
+        app = load_app(args.database_url)
+        import pagination
+        from types import SimpleNamespace
+        bulk_seed(rows)
+        async with client_for(app) as client:
+            print(f"{'depth':>10} {'offset ms':>10} {'id-cursor ms':>13} {'price-cursor ms':>16}")
+            for depth in (0, rows // 100, rows // 10, rows // 2, rows - limit):
+                offset_ms = await timed(lambda: client.get("/items/", params={"skip": depth, "limit": limit}), 20)
+                # Cursors as a client would hold after paging `depth` rows in
+                id_cursor = pagination.encode_cursor("id", SimpleNamespace(id=depth))
+                id_ms = await timed(lambda: client.get("/items/", params={"cursor": id_cursor, "limit": limit}), 20)
+                page = await client.get("/items/", params={"sort": "price", "skip": depth, "limit": 1})
+                price_cursor = pagination.encode_cursor("price", SimpleNamespace(**page.json()[0]))
+                price_ms = await timed(
+                    lambda: client.get("/items/", params={"sort": "price", "cursor": price_cursor, "limit": limit}), 20
+                )
+                print(f"{depth:>10} {offset_ms:>10.2f} {id_ms:>13.2f} {price_ms:>16.2f}")
+
+    asyncio.run(run())
+
+@scenario
+def bench_bulk(args):
+    """Items/sec for one POST per item vs. POST /items/bulk with JSON and NDJSON bodies"""
+    rows = args.rows
+    items = [{"name": f"bulk-{i}", "description": "bulk", "price": i % 100} for i in range(rows)]
+
+    async def run():
+        async with client_for(load_app(args.database_url)) as client:
+            single = min(rows, 2000)
+            start = time.perf_counter()
+            for item in items[:single]:
+                await client.post("/items/", json=item)
+            elapsed = time.perf_counter() - start
+            print(f"{'single POST':>14}: {single / elapsed:>10.0f} items/s ({single} items)")
+
+            for label, content_type, body in (
+                ("bulk JSON", "application/json", lambda: json.dumps(items).encode()),
+                ("bulk NDJSON", "application/x-ndjson", lambda: "\n".join(map(json.dumps, items)).encode()),
+            ):
+                start = time.perf_counter()
+                response = await client.post(
+                    "/items/bulk", content=body(), headers={"content-type": content_type},
+                    params={"batch_size": args.batch_size}, timeout=None,
+                )
+                elapsed = time.perf_counter() - start
+                print(f"{label:>14}: {response.json()['count'] / elapsed:>10.0f} items/s ({rows} items)")
+
+    asyncio.run(run())
+
+@scenario
+def bench_loader(args):
+    """Rows/sec for loader.py from CSV and Parquet, with and without the index drop/rebuild, into a live schema"""
+    from sqlalchemy import create_engine
+    import pyarrow as pa, pyarrow.csv as pacsv, pyarrow.parquet as pq
+    load_app(args.database_url)
+    import etags, loader, models, search, stats
+
+    with tempfile.TemporaryDirectory() as tmp:
+        table = pa.table({
+            "name": [f"load-{i}" for i in range(args.rows)],
+            "description": [None if i % 3 else f"row {i}" for i in range(args.rows)],
+            # One bad price per thousand rows exercises the reject path
+            "price": ["n/a" if i % 1000 == 999 else str((i * 7919) % 1000) for i in range(args.rows)],
+        })
+        pacsv.write_csv(table, f"{tmp}/items.csv")
+        pq.write_table(table, f"{tmp}/items.parquet")
+        for file_format in ("csv", "parquet"):
+            for rebuild in (False, True):
+                engine = create_engine(f"sqlite:///{tmp}/{file_format}-{rebuild}.db")
+                models.Base.metadata.create_all(bind=engine)
+                etags.ensure_version_column(engine)
+                search.ensure_index(engine)
+                stats.ensure_aggregates(engine)
+                chunks = loader.iter_chunks(f"{tmp}/items.{file_format}", chunk_rows=args.batch_size)
+                loaded, rejected, seconds = loader.load(engine, chunks, rebuild_indexes=rebuild)
+                engine.dispose()
+                label = f"{file_format}{' +rebuild' if rebuild else ''}"
+                print(f"{label:>16}: {loaded / seconds:>10.0f} rows/s ({loaded} loaded, {rejected} rejected)")
+
+def _decode_export(name, data):
+    """What a consumer does to turn an export into columns"""
+    import csv, io
+    if name == "ndjson":
+        rows = [json.loads(line) for line in data.splitlines()]
+        return {key: [row[key] for row in rows] for key in rows[0]}
+    if name == "csv":
+        return list(zip(*csv.reader(io.StringIO(data))))
+    import pyarrow as pa, pyarrow.parquet as pq
+    if name == "arrow":
+        return pa.ipc.open_stream(data).read_all()
+    return pq.read_table(pa.BufferReader(data))
+
+@scenario
+def bench_export(args):
+    """Throughput, peak memory and consumer decode time of the export streams at two table sizes"""
+    import tracemalloc
+    load_app(args.database_url)
+    import database, export
+
+    formats = [name for name in sorted(export.FORMATS) if name not in export.COLUMNAR_FORMATS or export.arrow_available()]
+    seeded = 0
+    for rows in (args.rows // 10, args.rows):
+        bulk_seed(rows - seeded)
+        seeded = rows
+        for name in formats:
+            stream, _ = export.FORMATS[name]
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in stream(database.engine))
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            chunks = list(stream(database.engine))
+            data = "".join(chunks) if isinstance(chunks[0], str) else b"".join(chunks)
+            start = time.perf_counter()
+            _decode_export(name, data)
+            decode = time.perf_counter() - start
+            print(
+                f"{rows:>10} rows {name:>7}: {rows / elapsed:>9.0f} rows/s, {size / 2**20:>7.1f} MiB out, "
+                f"peak {peak / 2**20:.2f} MiB, decode {decode * 1000:>7.0f} ms"
+            )
+
+@scenario
+def bench_mutations(args):
+    """Statements and latency per update/delete: read-then-write vs. single statement with RETURNING"""
+    load_app(args.database_url)
+    from sqlalchemy import event
+    import database, models
+
+    statements = []
+    event.listen(database.engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+
+    def legacy_update(item_id):
+        with database.SessionLocal() as db:
+            db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
+            for key, value in {"name": "legacy", "description": None, "price": 4.0}.items():
+                setattr(db_item, key, value)
+            db.commit()
+            db.refresh(db_item)
+
+    def legacy_delete(item_id):
+        with database.SessionLocal() as db:
+            db.delete(db.query(models.Item).filter(models.Item.id == item_id).first())
+            db.commit()
+
+    def handler(func, *args):
+        # Call the handler logic directly with a session, as the routes do
+        with database.SessionLocal() as db:
+            func(db, *args)
+
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from schemas import ItemCreate
+    import items
+    # update_item reads If-Match from the request and sets the ETag on the response
+    request = Request({"type": "http", "method": "PUT", "headers": []})
+    ops = min(args.requests, 2000)
+    bulk_seed(ops * 4)
+    cases = (
+        ("update: select+update+refresh", legacy_update),
+        ("update: UPDATE..RETURNING", lambda i: handler(items.update_item, i, ItemCreate(name="new", price=4.0), request, Response())),
+        ("delete: select+delete", legacy_delete),
+        ("delete: DELETE..RETURNING", lambda i: handler(items.delete_item, i)),
+    )
+    for n, (label, call) in enumerate(cases):
+        ids = range(n * ops + 1, (n + 1) * ops + 1)
+        del statements[:]
+        start = time.perf_counter()
+        for item_id in ids:
+            call(item_id)
+        elapsed = time.perf_counter() - start
+        print(f"{label:>30}: {len(statements) / ops:.1f} statements/op, {elapsed / ops * 1e6:>7.0f} us/op")
+
+@scenario
+def bench_contention(args):
+    """Read-modify-write increments on 5 hot items: blind PUTs vs If-Match with retry on 409; prints lost updates"""
+    async def run():
+        async with client_for(load_app(args.database_url)) as client:
+            hot = [(await client.post("/items/", json={"name": f"hot-{i}", "price": 0})).json()["id"] for i in range(5)]
+            for mode in ("blind", "if-match"):
+                for item_id in hot:
+                    await client.put(f"/items/{item_id}", json={"name": "hot", "price": 0})
+                conflicts = 0
+
+                async def worker(i):
+                    nonlocal conflicts
+                    item_id = hot[i % len(hot)]
+                    while True:
+                        current = await client.get(f"/items/{item_id}")
+                        headers = {"If-Match": current.headers["etag"]} if mode == "if-match" else {}
+                        body = {"name": "hot", "price": current.json()["price"] + 1}
+                        response = await client.put(f"/items/{item_id}", json=body, headers=headers)
+                        if response.status_code != 409:
+                            return
+                        conflicts += 1
+
+                elapsed = await drive(worker, args.requests, args.concurrency)
+                total = sum([(await client.get(f"/items/{item_id}")).json()["price"] for item_id in hot])
+                print(
+                    f"{mode:>9}: {args.requests / elapsed:>7.0f} increments/s ({total / elapsed:.0f} applied), "
+                    f"{conflicts:>5} retried conflicts, {args.requests - int(total):>5} lost updates"
+                )
+
+    asyncio.run(run())
+
+@scenario
+def bench_shard_mix(args):
+    """Create throughput and scatter-gather read latency for the current DATABASE_SHARD_URLS; prints one JSON line"""
+    async def run():
+        async with client_for(load_app(args.database_url)) as client:
+            await client.post("/items/bulk", json=[
+                {"name": f"seed {i}", "description": "seed", "price": (i * 7919) % 1000} for i in range(args.rows)
+            ])
+
+            async def create(i):
+                await client.post("/items/", json={"name": f"new {i}", "description": "bench", "price": i % 100})
+
+            elapsed = await drive(create, args.requests, args.concurrency)
+            ids = ",".join(str(i) for i in range(1, 201))
+            return {
+                "create_rps": round(args.requests / elapsed, 1),
+                "get_ms": round(await timed(lambda: client.get("/items/7"), 50), 2),
+                "page_ms": round(await timed(lambda: client.get("/items/", params={"limit": 50, "sort": "price"}), 20), 2),
+                "multiget_ms": round(await timed(lambda: client.get("/items/", params={"ids": ids}), 20), 2),
+                "search_ms": round(await timed(lambda: client.get("/items/search", params={"q": "seed 12"}), 20), 2),
+                "stats_ms": round(await timed(lambda: client.get("/items/stats"), 20), 2),
+            }
+
+    print(json.dumps(asyncio.run(run())))
+
+@scenario
+def bench_sharding(args):
+    """One SQLite file vs. items hash-sharded over 4 files: creates/s at --concurrency, then single-client read latency"""
+    extra = ["--requests", str(args.requests), "--concurrency", str(args.concurrency), "--rows", str(args.rows)]
+    for shards in (0, 4):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+                "DATABASE_SHARD_URLS": ",".join(f"sqlite:///{tmp}/shard{i}.db" for i in range(shards)),
+            }
+            result = run_child("shard_mix", env, extra)
+        print(f"{shards or 'no':>2} shards: " + ", ".join(f"{key} {value}" for key, value in result.items()))
+
+@scenario
+def bench_idempotency(args):
+    """Retry storm: every create sent 3 times at once, without and with an Idempotency-Key; counts rows written"""
+    async def run():
+        from sqlalchemy import func, select
+        app = load_app(args.database_url)
+        import database, models
+
+        def count():
+            with database.engine.connect() as conn:
+                return conn.execute(select(func.count()).select_from(models.Item)).scalar()
+
+        async with client_for(app) as client:
+            for mode in ("no key", "with key"):
+                before = count()
+
+                async def worker(i):
+                    headers = {"Idempotency-Key": f"bench-{i}"} if mode == "with key" else {}
+                    body = {"name": f"retry-{i}", "price": 1.0}
+                    await asyncio.gather(*(client.post("/items/", json=body, headers=headers) for _ in range(3)))
+
+                elapsed = await drive(worker, args.requests, args.concurrency)
+                written = count() - before
+                line = f"{mode:>8}: {args.requests} creates x3 in {elapsed:.2f}s, {written} rows written"
+                if mode == "with key":
+                    replay_ms = await timed(
+                        lambda: client.post("/items/", json={"name": "retry-0", "price": 1.0}, headers={"Idempotency-Key": "bench-0"}), 50
+                    )
+                    line += f", replay {replay_ms:.2f} ms"
+                print(line)
+
+    asyncio.run(run())
+
+@scenario
+def bench_multiget(args):
+    """Fetching a page of specific ids: one GET per id vs. a single GET /items/?ids="""
+    async def run():
+        async with client_for(load_app(args.database_url)) as client:
+            ids = await seed(client, 500)
+            rng = random.Random(0)
+            # A browser keeps about six connections per host
+            connections = asyncio.Semaphore(6)
+
+            async def get_one(item_id):
+                async with connections:
+                    await client.get(f"/items/{item_id}")
+
+            for count in (10, 50, 200):
+                wanted = rng.sample(ids, count)
+                one_by_one = await timed(lambda: asyncio.gather(*(get_one(i) for i in wanted)), 10)
+                joined = ",".join(map(str, wanted))
+                batched = await timed(lambda: client.get("/items/", params={"ids": joined}), 10)
+                print(f"{count:>4} ids: {one_by_one:>8.2f} ms one-by-one, {batched:>7.2f} ms with ?ids=")
+
+    asyncio.run(run())
+
+@scenario
+def bench_metrics(args):
+    """Cost of the metrics middleware and SQL hooks, in isolation and on the CRUD workload"""
+    import metrics
+
+    async def noop_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def noop_send(message):
+        pass
+
+    async def per_call(app, calls=100000):
+        scope = {"type": "http", "method": "GET", "path": "/"}
+        start = time.perf_counter()
+        for _ in range(calls):
+            await app(dict(scope), None, noop_send)
+        return (time.perf_counter() - start) / calls * 1e6
+
+    bare = asyncio.run(per_call(noop_app))
+    wrapped = asyncio.run(per_call(metrics.MetricsMiddleware(noop_app)))
+    print(f"middleware overhead: {wrapped - bare:.1f} us/request")
+
+    extra = ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    for enabled in ("false", "true"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {"DATABASE_URL": f"sqlite:///{tmp}/bench.db", "METRICS_ENABLED": enabled}
+            result = run_child("crud", env, extra)
+        print(f"METRICS_ENABLED={enabled:<5}: {result['rps']:>8} req/s")
+
+@scenario
+def bench_query_budget(args):
+    """CI check: the CRUD workload under QUERY_GUARD=raise; exits non-zero if any route exceeds its budget"""
+    extra = ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {"DATABASE_URL": f"sqlite:///{tmp}/bench.db", "QUERY_GUARD": "raise"}
+        try:
+            result = run_child("crud", env, extra)
+        except subprocess.CalledProcessError as e:
+            print(e.stderr.strip().splitlines()[-1])
+            sys.exit(1)
+    print(f"all routes within their query budgets ({result['requests']} requests)")
+
+@scenario
+def bench_change_feed(args):
+    """Consumer cost of spotting a stream of updates: diffing full listings vs. long-polling /items/changes"""
+    rows = min(args.rows, 10000)
+    updates = 50
+
+    async def run():
+        app = load_app(args.database_url)
+        bulk_seed(rows)
+        async with client_for(app) as client:
+            done = asyncio.Event()
+            cost = {"diff": [0, 0, 0], "feed": [0, 0, 0]}  # requests, rows received, changes seen
+
+            async def writer():
+                for i in range(updates):
+                    await asyncio.sleep(0.05)
+                    await client.put(f"/items/{i * 97 % rows + 1}", json={"name": f"changed-{i}", "price": 1.0})
+                await asyncio.sleep(0.5)
+                done.set()
+
+            async def snapshot():
+                items, cursor = {}, None
+                while True:
+                    params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+                    response = await client.get("/items/", params=params)
+                    page = response.json()
+                    cost["diff"][0] += 1
+                    cost["diff"][1] += len(page)
+                    items.update((item["id"], item) for item in page)
+                    cursor = response.headers.get("X-Next-Cursor")
+                    if cursor is None:
+                        return items
+
+            async def differ():
+                previous = await snapshot()
+                while not done.is_set():
+                    await asyncio.sleep(0.25)
+                    current = await snapshot()
+                    cost["diff"][2] += sum(1 for key, item in current.items() if previous.get(key) != item)
+                    previous = current
+
+            async def follower():
+                since = (await client.get("/items/changes", params={"limit": 1})).json()["next_since"]
+                while not done.is_set():
+                    body = (await client.get("/items/changes", params={"since": since, "wait": 1})).json()
+                    cost["feed"][0] += 1
+                    cost["feed"][1] += len(body["changes"])
+                    cost["feed"][2] += len(body["changes"])
+                    since = body["next_since"]
+
+            await asyncio.gather(writer(), differ(), follower())
+            for label, (requests, received, seen) in cost.items():
+                print(f"{label:>5}: {requests:>5} requests, {received:>7} rows received, {seen:>3}/{updates} updates seen")
+
+    asyncio.run(run())
+
+@scenario
+def bench_search(args):
+    """GET /items/search (FTS5, ranked) vs. a LIKE scan over name and description; use --rows 3000000 for production-sized tables"""
+    rng = random.Random(0)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "pe", "da", "zu", "fi"]
+    words = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(5000)})
+
+    async def run():
+        app = load_app(args.database_url)
+        from sqlalchemy import insert, or_, select
+        import database, models
+        start = time.perf_counter()
+        with database.engine.begin() as conn:
+            for offset in range(0, args.rows, 10000):
+                conn.execute(insert(models.Item), [
+                    {
+                        "name": " ".join(rng.choices(words, k=2)),
+                        "description": " ".join(rng.choices(words, k=8)),
+                        "price": rng.randrange(1000),
+                    }
+                    for _ in range(min(10000, args.rows - offset))
+                ])
+        print(f"seeded {args.rows} rows (FTS maintained by triggers) in {time.perf_counter() - start:.1f}s")
+
+        def like_scan(term):
+            pattern = f"%{term}%"
+            with database.engine.connect() as conn:
+                conn.execute(
+                    select(models.Item.id)
+                    .where(or_(models.Item.name.like(pattern), models.Item.description.like(pattern)))
+                    .order_by(models.Item.id)
+                    .limit(20)
+                ).all()
+
+        async with client_for(app) as client:
+            # LIKE stops at the first 20 rows in id order; search ranks every match before returning a page
+            print(f"{'query':>18} {'LIKE ms':>9} {'search ms':>10} {'page 5 ms':>10}")
+            for q in (words[len(words) // 2], words[7][:3], f"{words[100]} {words[200]}", "zzzz"):
+                like_ms = await timed(lambda: run_in_thread(like_scan, q.split()[0]), 5)
+                search_ms = await timed(lambda: client.get("/items/search", params={"q": q}), 20)
+                cursor = None
+                for _ in range(4):
+                    response = await client.get("/items/search", params={"q": q, **({"cursor": cursor} if cursor else {})})
+                    cursor = response.headers.get("X-Next-Cursor")
+                    if cursor is None:
+                        break
+                page = f"{await timed(lambda: client.get('/items/search', params={'q': q, 'cursor': cursor}), 20):.2f}" if cursor else "-"
+                print(f"{q:>18} {like_ms:>9.2f} {search_ms:>10.2f} {page:>10}")
+
+    async def run_in_thread(func, *call_args):
+        return await asyncio.to_thread(func, *call_args)
+
+    asyncio.run(run())
+
+@scenario
+def bench_stats(args):
+    """Price aggregates: paging GET /items/ vs. a SQL scan vs. GET /items/stats, as the table grows"""
+    async def run():
+        app = load_app(args.database_url)
+        from sqlalchemy import func, select
+        import database, models
+
+        def sql_scan():
+            with database.engine.connect() as conn:
+                conn.execute(select(func.count(), func.min(models.Item.price), func.max(models.Item.price), func.avg(models.Item.price))).one()
+
+        async def page_through():
+            count, total, cursor = 0, 0.0, None
+            while True:
+                response = await client.get("/items/", params={"limit": 1000, **({"cursor": cursor} if cursor else {})})
+                for item in response.json():
+                    count += 1
+                    total += item["price"]
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    return count, total
+
+        async with client_for(app) as client:
+            print(f"{'rows':>10} {'paging ms':>10} {'SQL scan ms':>12} {'/items/stats ms':>16}")
+            seeded = 0
+            for rows in (args.rows // 100, args.rows // 10, args.rows):
+                bulk_seed(rows - seeded)
+                seeded = rows
+                paging = await timed(page_through, 1) if rows <= 100000 else None
+                scan = await timed(lambda: asyncio.to_thread(sql_scan), 5)
+                served = await timed(lambda: client.get("/items/stats"), 50)
+                paging = f"{paging:.1f}" if paging is not None else "-"
+                print(f"{rows:>10} {paging:>10} {scan:>12.2f} {served:>16.2f}")
+
+    asyncio.run(run())
+
+@scenario
+def bench_sparse_fields(args):
+    """Payload and latency of item reads with every field vs. ?fields=id,name, with 2 KB descriptions"""
+    async def run():
+        app = load_app(args.database_url)
+        from sqlalchemy import insert
+        import database, models
+        rows = min(args.rows, 50000)
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Item), [
+                {"name": f"item-{i}", "description": "lorem ipsum " * 170, "price": i % 100} for i in range(rows)
+            ])
+        ids = ",".join(str(i) for i in range(1, rows, rows // 200))
+        async with client_for(app) as client:
+            for label, path, params in (
+                ("page of 100", "/items/", {"limit": 100}),
+                ("200 by ?ids=", "/items/", {"ids": ids}),
+                ("single item", f"/items/{rows // 2}", {}),
+            ):
+                for fields in (None, "id,name"):
+                    query = {**params, **({"fields": fields} if fields else {})}
+                    size = len((await client.get(path, params=query)).content)
+                    ms = await timed(lambda: client.get(path, params=query), 50)
+                    print(f"{label:>14} {fields or 'all fields':>10}: {size:>8} bytes {ms:>8.2f} ms")
+
+    asyncio.run(run())
+
+@scenario
+def bench_conditional_get(args):
+    """Full GETs vs. If-None-Match revalidation (304) for an item and a 100-item page, with 2 KB descriptions"""
+    async def run():
+        app = load_app(args.database_url)
+        from sqlalchemy import insert
+        import database, models
+        with database.engine.begin() as conn:
+            conn.execute(insert(models.Item), [
+                {"name": f"item-{i}", "description": "lorem ipsum " * 170, "price": i % 100} for i in range(5000)
+            ])
+        async with client_for(app) as client:
+            print(f"cache backend: {os.environ.get('CACHE_BACKEND', 'none')}")
+            for label, path, params in (("item", "/items/2500", {}), ("page of 100", "/items/", {"limit": 100})):
+                etag = (await client.get(path, params=params)).headers["ETag"]
+                for headers in ({}, {"If-None-Match": etag}):
+                    response = await client.get(path, params=params, headers=headers)
+                    ms = await timed(lambda: client.get(path, params=params, headers=headers), 100)
+                    print(f"{label:>12} {response.status_code}: {len(response.content):>7} bytes {ms:>7.2f} ms")
+
+    asyncio.run(run())
+
+@scenario
+def bench_slow_db(args):
+    """GET /items/{id} from many clients while every SQL statement takes 20 ms; prints one JSON line"""
+    async def run():
+        app = load_app(args.database_url)
+        from sqlalchemy import event
+        import database
+        bulk_seed(1000)
+        event.listen(database.engine, "before_cursor_execute", lambda *a: time.sleep(0.02))
+        async with client_for(app) as client:
+            latencies = []
+            statuses = {}
+
+            async def worker(i):
+                start = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(client.get(f"/items/{i % 1000 + 1}"), 10)
+                    status = response.status_code
+                except asyncio.TimeoutError:
+                    status = "timeout"
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+
+            elapsed = await drive(worker, args.requests, args.concurrency)
+            latencies.sort()
+            quantile = lambda q: round(percentile(latencies, q) * 1000, 1) if latencies else None
+            metrics_ms = await timed(lambda: client.get("/metrics"), 5)
+            return {
+                "seconds": round(elapsed, 2),
+                "statuses": {str(key): value for key, value in sorted(statuses.items(), key=str)},
+                "p50_ms": quantile(0.5),
+                "p99_ms": quantile(0.99),
+                "metrics_ms": round(metrics_ms, 1),
+            }
+
+    print(json.dumps(asyncio.run(run())))
+
+@scenario
+def bench_admission(args):
+    """Slow-database overload without and with admission control (limit 10 per route, 250 ms queue deadline)"""
+    extra = ["--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+    for enabled in ("false", "true"):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {
+                "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+                "ADMISSION_CONTROL": enabled,
+                "ADMISSION_DEFAULT_LIMIT": "10",
+            }
+            result = run_child("slow_db", env, extra)
+        print(
+            f"ADMISSION_CONTROL={enabled:<5}: {result['statuses']} in {result['seconds']}s, "
+            f"200s p50 {result['p50_ms']} ms p99 {result['p99_ms']} ms, /metrics {result['metrics_ms']} ms"
+        )
+
+@scenario
+def bench_inserts(args):
+    """POST /items/ only, under the current WRITE_BATCHING setting; prints one JSON line"""
+    async def run():
+        app = load_app(args.database_url)
+        import main
+        async with client_for(app) as client:
+            async def worker(i):
+                response = await client.post("/items/", json={"name": f"new-{i}", "price": 2.0})
+                assert response.status_code == 200
+
+            elapsed = await drive(worker, args.requests, args.concurrency)
+            batcher = main.items_batcher()
+            return {"rps": round(args.requests / elapsed, 1), "batcher": batcher.stats() if batcher else None}
+
+    print(json.dumps(asyncio.run(run())))
+
+@scenario
+def bench_write_batching(args):
+    """Insert throughput as concurrency grows, one transaction per row vs group commit"""
+    # Sync handlers holding pooled connections deadlock past the pool size without batching, so stay under it
+    for concurrency in (1, 4, 12):
+        extra = ["--requests", str(args.requests), "--concurrency", str(concurrency)]
+        for enabled in ("false", "true"):
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {"DATABASE_URL": f"sqlite:///{tmp}/bench.db", "WRITE_BATCHING": enabled}
+                result = run_child("inserts", env, extra)
+            batcher = result["batcher"]
+            rows = f"  {batcher['avg_batch_rows']} rows/commit" if batcher else ""
+            print(f"concurrency={concurrency:<3} WRITE_BATCHING={enabled:<5}: {result['rps']:>8} req/s{rows}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=200000, help="rows seeded by table-size scenarios")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--seed-rows", type=int, default=5000, help="rows seeded by the load scenario")
+    parser.add_argument("--warmup", type=int, default=200, help="load requests sent before measuring")
+    parser.add_argument("--baseline", default=None, help="load report JSON to compare against; exits 1 on regression")
+    parser.add_argument("--save-baseline", default=None, help="write this run's load report to a file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against --baseline")
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        args.database_url = os.environ.get("DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    SCENARIOS[args.scenario](args)
+
+if __name__ == "__main__":
+    main()
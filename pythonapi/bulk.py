@@ -0,0 +1,125 @@
+import codecs
+import contextvars
+import json
+import os
+import re
+from sqlalchemy import insert
+import changes
+import models
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+
+class BulkParseError(ValueError):
+    pass
+
+async def iter_ndjson(chunks):
+    """Yield one decoded value per non-blank line of a byte stream"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    async for chunk in chunks:
+        buf += decoder.decode(chunk)
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            if line.strip():
+                yield _loads(line)
+    buf += decoder.decode(b"", final=True)
+    if buf.strip():
+        yield _loads(buf)
+
+def _loads(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        raise BulkParseError(f"Invalid JSON line: {e}")
+
+# Where a literal, number or escape ends; a failure with none of these after it may just be cut short by the chunk
+_TOKEN_END = re.compile(r'[\s,:\[\]{}"]')
+
+def _cut_short(buf, error):
+    """True when the decoder ran off the end of buf, false for a real syntax error"""
+    if error.msg.startswith("Unterminated string"):
+        return True
+    return _TOKEN_END.search(buf, error.pos) is None
+
+async def iter_json_array(chunks):
+    """Yield the elements of a top-level JSON array without buffering the whole body"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = json.JSONDecoder()
+    buf = ""
+    # Characters already dropped from the front of buf, so errors report offsets into the body
+    consumed = 0
+    state = "start"
+    async for chunk in chunks:
+        buf += decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos == len(buf):
+                break
+            char = buf[pos]
+            if state == "start":
+                if char != "[":
+                    raise BulkParseError("Expected a JSON array")
+                state, pos = "first", pos + 1
+            elif state == "next":
+                if char not in ",]":
+                    raise BulkParseError(f"Expected ',' or ']' at offset {consumed + pos}")
+                state = "value" if char == "," else "done"
+                pos += 1
+            elif state in ("first", "value"):
+                if char == "]" and state == "first":
+                    state, pos = "done", pos + 1
+                    continue
+                try:
+                    value, pos = parser.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    if not _cut_short(buf, e):
+                        raise BulkParseError(f"Invalid JSON: {e.msg} at offset {consumed + e.pos}")
+                    # Element is split across chunks; wait for more data
+                    break
+                state = "next"
+                yield value
+            else:
+                raise BulkParseError("Unexpected data after the JSON array")
+        buf = buf[pos:]
+        consumed += pos
+    if state != "done" or buf.strip():
+        raise BulkParseError("Truncated or malformed JSON array")
+
+# Per engine: MySQL numbers the rows of one INSERT auto_increment_increment apart
+_autoinc_steps = {}
+
+def _autoinc_step(db):
+    bind = db.get_bind()
+    if bind not in _autoinc_steps:
+        # Read once per process, so it is kept out of the request's query budget
+        _autoinc_steps[bind] = contextvars.Context().run(
+            lambda: db.connection().exec_driver_sql("SELECT @@auto_increment_increment").scalar()
+        )
+    return _autoinc_steps[bind]
+
+def insert_batch(db, rows):
+    """Insert validated rows in one statement and transaction, returning their ids"""
+    if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        ids = db.scalars(insert(models.Item).returning(models.Item.id, sort_by_parameter_order=True), rows).all()
+    elif db.get_bind().dialect.name == "mysql":
+        # No RETURNING: one multi-row INSERT. InnoDB hands a simple INSERT's ids out as one block and
+        # lastrowid is the first of them, so the rest follow
+        result = db.execute(insert(models.Item.__table__).values(rows))
+        if all("id" in row for row in rows):
+            ids = [row["id"] for row in rows]
+        else:
+            step = _autoinc_step(db)
+            ids = list(range(result.lastrowid, result.lastrowid + step * len(rows), step))
+    else:
+        # Anything else without RETURNING: let the ORM flush and collect each lastrowid
+        objects = [models.Item(**row) for row in rows]
+        db.add_all(objects)
+        db.flush()
+        ids = [obj.id for obj in objects]
+    changes.record(db, ids, "create")
+    db.commit()
+    return ids
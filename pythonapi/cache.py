@@ -0,0 +1,231 @@
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.util.concurrency import await_only, in_greenlet
+
+# memory | redis | none
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none").lower()
+CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# How long invalidate() keeps readers that loaded a row before the write from caching it
+CACHE_TOMBSTONE_SECONDS = float(os.getenv("CACHE_TOMBSTONE_SECONDS", "5"))
+
+class Tombstone:
+    """Left by invalidate(): a miss for get(), and fill() of a version older than `version` (any, for None) is refused"""
+
+    __slots__ = ("version",)
+
+    def __init__(self, version=None):
+        self.version = version
+
+    def admits(self, version):
+        return self.version is not None and version is not None and version >= self.version
+
+class NullCache:
+    """Cache that never stores anything"""
+
+    backend = "none"
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def fill(self, key, value, version=None):
+        """Cache a row just read from the database; never replaces a cached row or a newer tombstone"""
+
+    def delete(self, key):
+        pass
+
+    def invalidate(self, key, version=None):
+        """Replace a written row with a Tombstone, so readers that loaded it before the write cannot cache it again"""
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class LRUCache(NullCache):
+    """In-process LRU cache whose entries also expire after `ttl` seconds"""
+
+    backend = "memory"
+
+    def __init__(self, maxsize=CACHE_MAX_ITEMS, ttl=CACHE_TTL_SECONDS, tombstone_ttl=CACHE_TOMBSTONE_SECONDS):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires <= time.monotonic():
+                    del self._data[key]
+                elif not isinstance(value, Tombstone):
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def _live(self, key):
+        # Caller holds the lock
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def _put(self, key, value, ttl):
+        # Caller holds the lock
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value):
+        with self._lock:
+            self._put(key, value, self.ttl)
+
+    def fill(self, key, value, version=None):
+        with self._lock:
+            if self._live(key):
+                current = self._data[key][0]
+                if not (isinstance(current, Tombstone) and current.admits(version)):
+                    return
+            self._put(key, value, self.ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, key, version=None):
+        with self._lock:
+            self._put(key, Tombstone(version), self.tombstone_ttl)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def _off_loop(method):
+    """A blocking Redis call made under AsyncSession.run_sync (DB_ASYNC) would hold up the event loop; there it runs on a worker thread"""
+    @functools.wraps(method)
+    def call(*args, **kwargs):
+        if in_greenlet():
+            return await_only(asyncio.to_thread(method, *args, **kwargs))
+        return method(*args, **kwargs)
+    return call
+
+# Redis value of a Tombstone, followed by its version if it has one
+TOMBSTONE_PREFIX = b"tombstone:"
+
+class RedisCache(NullCache):
+    """Cache shared between workers through any Redis-protocol server"""
+
+    backend = "redis"
+
+    def __init__(self, url=CACHE_REDIS_URL, ttl=CACHE_TTL_SECONDS, prefix="item:", client=None, tombstone_ttl=CACHE_TOMBSTONE_SECONDS):
+        super().__init__()
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.prefix = prefix
+
+    @_off_loop
+    def get(self, key):
+        raw = self.client.get(self.prefix + str(key))
+        if raw is None or raw.startswith(TOMBSTONE_PREFIX):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    @_off_loop
+    def set(self, key, value):
+        self.client.set(self.prefix + str(key), json.dumps(value), px=int(self.ttl * 1000))
+
+    @_off_loop
+    def fill(self, key, value, version=None):
+        name = self.prefix + str(key)
+        data = json.dumps(value)
+        px = int(self.ttl * 1000)
+        if self.client.set(name, data, nx=True, px=px):
+            return
+
+        def replace_tombstone(pipe):
+            raw = pipe.get(name)
+            if raw is None or (raw.startswith(TOMBSTONE_PREFIX) and _tombstone(raw).admits(version)):
+                pipe.multi()
+                pipe.set(name, data, px=px)
+
+        # WATCH/MULTI: redis-py re-runs the check if another client changes the key before EXEC
+        self.client.transaction(replace_tombstone, name)
+
+    @_off_loop
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+    @_off_loop
+    def invalidate(self, key, version=None):
+        value = TOMBSTONE_PREFIX + (b"" if version is None else str(version).encode())
+        self.client.set(self.prefix + str(key), value, px=int(self.tombstone_ttl * 1000))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+    def stats(self):
+        stats = super().stats()
+        # Redis evicts on its own maxmemory policy; report the server-wide counter
+        stats["evictions"] = int(self.client.info("stats").get("evicted_keys", 0))
+        return stats
+
+def _tombstone(raw):
+    version = raw[len(TOMBSTONE_PREFIX):]
+    return Tombstone(int(version) if version else None)
+
+def create_cache(backend=CACHE_BACKEND):
+    if backend == "memory":
+        return LRUCache()
+    if backend == "redis":
+        return RedisCache()
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_BACKEND {backend!r}")
+
+# Cache of ItemResponse dicts keyed by item id, shared by the item endpoints
+item_cache = create_cache()
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import threading
+import time
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+from fastjson import ITEM_COLUMNS
+import models
+
+CHANGES_MAX_LIMIT = int(os.getenv("CHANGES_MAX_LIMIT", "1000"))
+CHANGES_MAX_WAIT_SECONDS = float(os.getenv("CHANGES_MAX_WAIT_SECONDS", "30"))
+# Long-polls re-query at least this often, which picks up commits made by other processes
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+# seq is assigned at INSERT but transactions commit in any order; a gap in it is
+# waited on this long before it is taken to be a rollback rather than a commit to come
+CHANGES_GAP_SECONDS = float(os.getenv("CHANGES_GAP_SECONDS", "5"))
+
+class ChangeNotifier:
+    """Wakes long-polling readers when a session that recorded changes commits in this process"""
+
+    def __init__(self):
+        self.version = 0
+        self._waiters = set()
+        self._lock = threading.Lock()
+
+    def notify(self):
+        # Called from whichever thread committed; futures are resolved on their own loops
+        with self._lock:
+            self.version += 1
+            waiters, self._waiters = self._waiters, set()
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait(self, version, timeout):
+        """Return once notify() has run since `version` was read, or after `timeout` seconds"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            if self.version != version:
+                return
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+change_notifier = ChangeNotifier()
+
+def _statement(item_ids, op):
+    return insert(models.ItemChange), [{"item_id": item_id, "op": op} for item_id in item_ids]
+
+def record(db, item_ids, op):
+    """Append changes in the caller's transaction; readers are notified when it commits"""
+    db.execute(*_statement(item_ids, op))
+    db.info["item_changes"] = True
+
+# AsyncSession commits through its sync Session, so this covers both modes
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    if session.info.pop("item_changes", False):
+        change_notifier.notify()
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("item_changes", None)
+
+def changes_query(since, limit):
+    # The item's current row rides along, so consumers need no follow-up GETs
+    return (
+        select(
+            models.ItemChange.seq,
+            models.ItemChange.op,
+            models.ItemChange.item_id,
+            *(column.label(f"current_{column.name}") for column in ITEM_COLUMNS),
+        )
+        .outerjoin(models.Item, models.Item.id == models.ItemChange.item_id)
+        .where(models.ItemChange.seq > since)
+        .order_by(models.ItemChange.seq)
+        .limit(limit)
+    )
+
+def to_change(row):
+    values = row._mapping
+    item = None
+    if row.op != "delete" and values["current_id"] is not None:
+        item = {column.name: values[f"current_{column.name}"] for column in ITEM_COLUMNS}
+    return {"seq": row.seq, "op": row.op, "item_id": row.item_id, "item": item}
+
+class GapTracker:
+    """Holds back the rows after a seq gap, so a consumer never pages past a change that commits late
+
+    Gaps are remembered from the first time this process sees them; once one has stayed
+    open for `lag` seconds every seq up to it counts as settled.
+    """
+
+    def __init__(self, lag=CHANGES_GAP_SECONDS):
+        self.lag = lag
+        self.settled = 0
+        self._first_seen = {}
+        self._lock = threading.Lock()
+
+    def visible(self, rows, since):
+        """The leading rows of `rows` (seq > since, in order) that no open gap precedes"""
+        now = time.monotonic()
+        expected = since + 1
+        with self._lock:
+            for index, row in enumerate(rows):
+                if row.seq == expected:
+                    self._first_seen.pop(row.seq, None)
+                elif row.seq > self.settled:
+                    first_seen = self._first_seen.setdefault(row.seq, now)
+                    if now - first_seen < self.lag:
+                        return rows[:index]
+                    self.settled = row.seq
+                    self._first_seen = {seq: seen for seq, seen in self._first_seen.items() if seq > row.seq}
+                expected = row.seq + 1
+        return rows
+
+gap_tracker = GapTracker()
+
+def fetch(db, since, limit):
+    rows = db.execute(changes_query(since, limit)).all()
+    return [to_change(row) for row in gap_tracker.visible(rows, since)]
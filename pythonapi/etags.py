@@ -0,0 +1,66 @@
+import hashlib
+import os
+from fastapi import HTTPException, Response
+from sqlalchemy import inspect, text
+
+# Reject PUTs without If-Match (428), so no client can overwrite a change it has not seen
+REQUIRE_IF_MATCH = os.getenv("REQUIRE_IF_MATCH", "false").lower() in ("1", "true", "yes")
+
+def ensure_version_column(engine):
+    """Add items.version to databases created before it existed; create_all does not alter tables"""
+    if "version" not in {column["name"] for column in inspect(engine).get_columns("items")}:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE items ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+def _variant(fields):
+    # ?fields= responses are different representations, so they get different tags
+    return "" if fields is None else "-" + ".".join(fields)
+
+def item_etag(item_id, version, fields=None):
+    return f'"{item_id}-{version}{_variant(fields)}"'
+
+def collection_etag(items, fields=None):
+    """Strong tag for a list response, derived from each item's (id, version)"""
+    digest = hashlib.blake2b(digest_size=12)
+    for item in items:
+        item_id, version = (item["id"], item["version"]) if isinstance(item, dict) else (item.id, item.version)
+        digest.update(f"{item_id}:{version},".encode())
+    return f'"{digest.hexdigest()}{_variant(fields)}"'
+
+def matches(if_none_match, etag):
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored"""
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+def not_modified(etag):
+    return Response(status_code=304, headers={"ETag": etag})
+
+def if_match_versions(if_match, item_id):
+    """Versions of item_id an If-Match header accepts, or None when any version will do
+
+    Tags from ?fields= reads name the same row version, so they are accepted too; weak and
+    foreign tags never match, as If-Match uses the strong comparison.
+    """
+    if if_match is None:
+        if REQUIRE_IF_MATCH:
+            raise HTTPException(status_code=428, detail="If-Match is required to update an item")
+        return None
+    versions = set()
+    for tag in (tag.strip() for tag in if_match.split(",")):
+        if tag == "*":
+            return None
+        tag_id, _, rest = tag.strip('"').partition("-")
+        version = rest.split("-", 1)[0]
+        if tag.startswith('"') and tag_id == str(item_id) and version.isdigit():
+            versions.add(int(version))
+    return versions
+
+def conflict(item_id, current_version):
+    """409 for a compare-and-swap that lost; the current tag lets the client re-read and retry"""
+    return HTTPException(
+        status_code=409,
+        detail=f"Item {item_id} has changed (now version {current_version})",
+        headers={"ETag": item_etag(item_id, current_version)},
+    )
@@ -0,0 +1,188 @@
+import csv
+import heapq
+import io
+import itertools
+import json
+import os
+import sys
+from sqlalchemy import select
+import models
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+# Rows per Arrow record batch / Parquet row group, and per cursor fetch or id page behind it; bounds
+# export memory for the columnar formats
+EXPORT_ARROW_BATCH_ROWS = int(os.getenv("EXPORT_ARROW_BATCH_ROWS", "65536"))
+
+COLUMNS = [column for column in models.Item.__table__.columns]
+_ID = [column.key for column in COLUMNS].index("id")
+
+def _streams(engine):
+    # sqlite3 steps the statement as rows are fetched, so it streams without a server-side cursor
+    return engine.dialect.supports_server_side_cursors or engine.dialect.name == "sqlite"
+
+def iter_row_chunks(engine, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Plain row tuples in id order, `chunk_rows` at a time, with no ORM objects"""
+    if not _streams(engine):
+        yield from _iter_keyset_chunks(engine, chunk_rows)
+        return
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(
+            select(*COLUMNS).order_by(models.Item.id)
+        )
+        for chunk in result.partitions():
+            yield chunk
+
+def _iter_keyset_chunks(engine, chunk_rows):
+    """One WHERE id > last page per chunk, for drivers such as mysql-connector that buffer every result
+
+    Unlike a single cursor the pages are not one snapshot: rows written during the export may or may not be in it.
+    """
+    stmt = select(*COLUMNS).order_by(models.Item.id).limit(chunk_rows)
+    chunk = None
+    while chunk is None or len(chunk) == chunk_rows:
+        with engine.connect() as conn:
+            chunk = conn.execute(stmt if chunk is None else stmt.where(models.Item.id > chunk[-1][_ID])).all()
+        if chunk:
+            yield chunk
+
+def iter_merged_row_chunks(engines, chunk_rows=EXPORT_CHUNK_ROWS):
+    """iter_row_chunks() over every shard: each streams in id order and a k-way merge keeps the global order"""
+    streams = [itertools.chain.from_iterable(iter_row_chunks(shard, chunk_rows)) for shard in engines]
+    merged = heapq.merge(*streams, key=lambda row: row[_ID])
+    while True:
+        chunk = list(itertools.islice(merged, chunk_rows))
+        if not chunk:
+            return
+        yield chunk
+
+def _row_chunks(source, chunk_rows):
+    # The format streams take one engine, or a list of shard engines to merge
+    if isinstance(source, list):
+        return iter_merged_row_chunks(source, chunk_rows)
+    return iter_row_chunks(source, chunk_rows)
+
+def iter_ndjson(engine, chunk_rows=EXPORT_CHUNK_ROWS):
+    keys = [column.key for column in COLUMNS]
+    for chunk in _row_chunks(engine, chunk_rows):
+        yield "".join(json.dumps(dict(zip(keys, row))) + "\n" for row in chunk)
+
+def iter_csv(engine, chunk_rows=EXPORT_CHUNK_ROWS):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([column.key for column in COLUMNS])
+    for chunk in _row_chunks(engine, chunk_rows):
+        writer.writerows(chunk)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([
+        pa.field("id", pa.int64(), nullable=False),
+        pa.field("name", pa.string()),
+        pa.field("description", pa.string()),
+        pa.field("price", pa.float64()),
+        pa.field("version", pa.int64(), nullable=False),
+    ])
+
+def iter_record_batches(engine, batch_rows=EXPORT_ARROW_BATCH_ROWS):
+    """Arrow record batches built column by column from each chunk of rows; no more than batch_rows rows are held at once"""
+    import pyarrow as pa
+    schema = arrow_schema()
+    for chunk in _row_chunks(engine, batch_rows):
+        columns = list(zip(*chunk))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for field, values in zip(schema, columns)], schema=schema
+        )
+
+class _ChunkSink:
+    """Write-only file object whose bytes are handed to the response as soon as they are produced"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Parquet records absolute offsets in its footer, so report the total written, not the buffered size
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _open_writer(format, sink):
+    import pyarrow as pa
+    if format == "arrow":
+        return pa.ipc.new_stream(sink, arrow_schema())
+    import pyarrow.parquet as pq
+    return pq.ParquetWriter(sink, arrow_schema(), compression="zstd")
+
+def _iter_columnar(format):
+    """Stream factory for an Arrow IPC stream or a Parquet file, emitted one batch / row group at a time"""
+    def stream(engine, batch_rows=EXPORT_ARROW_BATCH_ROWS):
+        import pyarrow as pa
+        sink = _ChunkSink()
+        with _open_writer(format, pa.PythonFile(sink, mode="w")) as writer:
+            for batch in iter_record_batches(engine, batch_rows):
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+    return stream
+
+iter_arrow = _iter_columnar("arrow")
+iter_parquet = _iter_columnar("parquet")
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+FORMATS = {
+    "ndjson": (iter_ndjson, "application/x-ndjson"),
+    "csv": (iter_csv, "text/csv"),
+    "arrow": (iter_arrow, "application/vnd.apache.arrow.stream"),
+    "parquet": (iter_parquet, "application/vnd.apache.parquet"),
+}
+
+# Formats that need the optional pyarrow dependency
+COLUMNAR_FORMATS = ("arrow", "parquet")
+
+def main():
+    import argparse
+    # The database comes from DATABASE_URL, as for the app: DATABASE_URL=sqlite:///./test.db python export.py items.parquet
+    parser = argparse.ArgumentParser(description="Export the items table")
+    parser.add_argument("output", help="file to write, or - for stdout")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--batch-rows", type=int, default=None, help="rows per chunk / record batch")
+    args = parser.parse_args()
+
+    from database import engine, shard_engines
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    stream, _ = FORMATS[args.format]
+    default_rows = EXPORT_ARROW_BATCH_ROWS if args.format in COLUMNAR_FORMATS else EXPORT_CHUNK_ROWS
+    with out:
+        for chunk in stream(shard_engines or engine, args.batch_rows or default_rows):
+            out.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+from fastapi import Response
+import models
+
+try:
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value)
+except ImportError:
+    import json
+
+    def dumps(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+# Opt-in: list endpoints select column tuples and serialize them without ItemResponse validation
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+ITEM_COLUMNS = tuple(models.Item.__table__.columns)
+
+def json_response(content, headers=None):
+    return Response(content=dumps(content), media_type="application/json", headers=headers)
+
+def rows_response(rows, headers=None):
+    return json_response([row._asdict() for row in rows], headers)
@@ -0,0 +1,33 @@
+from fastapi import HTTPException, Query
+from typing import Optional
+from fastjson import ITEM_COLUMNS
+
+ITEM_FIELDS = {column.name: column for column in ITEM_COLUMNS}
+
+def parse_fields(raw):
+    """Field names from ?fields=id,name in table order; id is always included"""
+    names = {name.strip() for name in raw.split(",") if name.strip()}
+    unknown = names - ITEM_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))} (choose from {', '.join(ITEM_FIELDS)})")
+    return tuple(name for name in ITEM_FIELDS if name in names or name == "id")
+
+def requested_fields(
+    fields: Optional[str] = Query(None, description="Comma-separated item fields to return, e.g. id,name"),
+):
+    """Dependency for item reads: None means every field"""
+    if fields is None:
+        return None
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def field_columns(fields, extra=()):
+    """Columns to SELECT: the requested fields plus any the handler needs itself, e.g. sort keys for the cursor"""
+    names = set(fields) | {column.key for column in extra}
+    return [column for name, column in ITEM_FIELDS.items() if name in names]
+
+def project(item, fields):
+    """Trim a full item dict or row mapping to the requested fields"""
+    return {name: item[name] for name in fields}
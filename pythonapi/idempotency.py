@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from cache import CACHE_REDIS_URL, LRUCache, RedisCache
+from metrics import Counter
+
+# memory | redis | none; only requests carrying an Idempotency-Key header are affected
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_REDIS_URL = os.getenv("IDEMPOTENCY_REDIS_URL", CACHE_REDIS_URL)
+# How long a duplicate waits for the first request to finish before getting a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+# An in-flight claim outlives a worker that died holding it by this long at most
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.05"))
+
+IDEMPOTENT_ROUTES = {("POST", "/items/"), ("POST", "/items/bulk")}
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total",
+    "Requests with an Idempotency-Key by outcome (stored, replayed, in_flight, mismatch, not_stored)",
+)
+
+PENDING = {"state": "pending"}
+
+class MemoryStore(LRUCache):
+    """Bounded TTL store for one process"""
+
+    def add(self, key, value, ttl):
+        """Set key unless it is present; True when this call stored it"""
+        with self._lock:
+            if self._live(key):
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def extend(self, key, value, ttl):
+        """Push back the expiry of a key that is still present"""
+        with self._lock:
+            if self._live(key):
+                self._put(key, value, ttl)
+
+class RedisStore(RedisCache):
+    """Store shared by every worker through a Redis-protocol server"""
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(self.prefix + str(key), json.dumps(value), nx=True, px=int(ttl * 1000)))
+
+    def extend(self, key, value, ttl):
+        self.client.set(self.prefix + str(key), json.dumps(value), xx=True, px=int(ttl * 1000))
+
+def create_store(backend=IDEMPOTENCY_BACKEND):
+    if backend == "memory":
+        return MemoryStore(maxsize=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL_SECONDS)
+    if backend == "redis":
+        return RedisStore(url=IDEMPOTENCY_REDIS_URL, ttl=IDEMPOTENCY_TTL_SECONDS, prefix="idempotency:")
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND {backend!r}")
+
+async def _send_json(send, status, detail, headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+# Module level because Starlette rebuilds middleware instances
+store = create_store()
+# Futures of the requests this process is running, by store key; same-process duplicates wait on these
+in_flight = {}
+
+class IdempotencyMiddleware:
+    """Pure ASGI middleware: the first response per (route, Idempotency-Key) is stored and replayed to retries"""
+
+    def __init__(self, app):
+        self.app = app
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            await self.app(scope, receive, send)
+            return
+        key = dict(scope["headers"]).get(b"idempotency-key")
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+            return
+        store_key = f'{scope["path"]}:{key.decode("latin-1")}'
+
+        # A request this process is still running is waited on, never claimed again
+        if store_key not in in_flight and await self._store("add", store_key, PENDING, IDEMPOTENCY_LOCK_SECONDS):
+            await self._run_first(store_key, scope, receive, send)
+            return
+        record = await self._wait(store_key)
+        if record is None and store_key not in in_flight:
+            # The first request stored nothing or its worker died; this one takes over
+            if await self._store("add", store_key, PENDING, IDEMPOTENCY_LOCK_SECONDS):
+                await self._run_first(store_key, scope, receive, send)
+                return
+            record = await self._wait(store_key)
+        if record is None or record.get("state") == "pending":
+            IDEMPOTENCY_REQUESTS.inc((("outcome", "in_flight"),))
+            await _send_json(
+                send, 409, "A request with this Idempotency-Key is still in progress", [(b"retry-after", b"1")]
+            )
+            return
+        await self._replay(record, receive, send)
+
+    async def _store(self, method, *args):
+        # A Redis round trip blocks; on a worker thread it does not stall every request on the event loop
+        if isinstance(self.store, RedisStore):
+            return await asyncio.to_thread(getattr(self.store, method), *args)
+        return getattr(self.store, method)(*args)
+
+    async def _run_first(self, store_key, scope, receive, send):
+        future = in_flight[store_key] = asyncio.get_running_loop().create_future()
+        digest = hashlib.sha256()
+        body_done = False
+        status = None
+        headers = []
+        chunks = []
+
+        async def hashing_receive():
+            nonlocal body_done
+            message = await receive()
+            if message["type"] == "http.request":
+                digest.update(message.get("body", b""))
+                body_done = not message.get("more_body", False)
+            return message
+
+        async def heartbeat():
+            # Keeps the claim alive while this request runs; the lock TTL only covers a dead worker
+            while not done.is_set():
+                try:
+                    await asyncio.wait_for(done.wait(), IDEMPOTENCY_LOCK_SECONDS / 3)
+                except asyncio.TimeoutError:
+                    await self._store("extend", store_key, PENDING, IDEMPOTENCY_LOCK_SECONDS)
+
+        async def capturing_send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        record = None
+        done = asyncio.Event()
+        renewal = asyncio.create_task(heartbeat())
+        try:
+            await self.app(scope, hashing_receive, capturing_send)
+            # Server errors are not stored, so a retry runs the request again
+            if status is not None and status < 500:
+                record = {
+                    "state": "done",
+                    # Only a fully read body can be compared with a retry's
+                    "fingerprint": digest.hexdigest() if body_done else None,
+                    "status": status,
+                    "headers": [
+                        [name.decode("latin-1"), value.decode("latin-1")]
+                        for name, value in headers
+                        if name.lower() not in (b"content-length", b"set-cookie")
+                    ],
+                    "body": b"".join(chunks).decode("latin-1"),
+                }
+        finally:
+            # Stopped rather than cancelled, so an extend still running on its thread cannot land after the record
+            done.set()
+            try:
+                await renewal
+                if record is not None:
+                    await self._store("set", store_key, record)
+                    IDEMPOTENCY_REQUESTS.inc((("outcome", "stored"),))
+                else:
+                    await self._store("delete", store_key)
+                    IDEMPOTENCY_REQUESTS.inc((("outcome", "not_stored"),))
+            finally:
+                if in_flight.get(store_key) is future:
+                    del in_flight[store_key]
+                future.set_result(record)
+
+    async def _wait(self, store_key):
+        """The stored record once the request holding the key finishes; None if it stored nothing"""
+        future = in_flight.get(store_key)
+        if future is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), IDEMPOTENCY_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                return PENDING
+        # Held by another worker: poll the shared store
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record = await self._store("get", store_key)
+            if record is None or record.get("state") != "pending" or time.monotonic() >= deadline:
+                return record
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    async def _replay(self, record, receive, send):
+        if record["fingerprint"] is not None:
+            digest = hashlib.sha256()
+            while True:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return
+                digest.update(message.get("body", b""))
+                if not message.get("more_body", False):
+                    break
+            if digest.hexdigest() != record["fingerprint"]:
+                IDEMPOTENCY_REQUESTS.inc((("outcome", "mismatch"),))
+                await _send_json(send, 422, "Idempotency-Key was already used with a different request body")
+                return
+        IDEMPOTENCY_REQUESTS.inc((("outcome", "replayed"),))
+        body = record["body"].encode("latin-1")
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+        headers += [(b"content-length", str(len(body)).encode()), (b"idempotent-replayed", b"true")]
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+def render():
+    return IDEMPOTENCY_REQUESTS.render()
@@ -0,0 +1,188 @@
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from sqlalchemy.orm import Session
+from cache import item_cache
+from database import from_replica, wrote_recently
+from fastjson import FAST_JSON, ITEM_COLUMNS, json_response, rows_response
+from fields import field_columns, project
+from multiget import MULTIGET_CHUNK_SIZE, MULTIGET_MAX_IDS, cached_items, chunked, in_request_order, parse_ids
+from pagination import SORT_KEYS, InvalidCursor, next_cursor, paginate
+from schemas import ItemResponse
+from sharding import SHARD_COUNT, SHARDED
+import changes
+import etags
+import models
+import sharding
+
+# Item endpoint logic, written once against a blocking Session: main.py calls it from its
+# handlers and async_items.py through AsyncSession.run_sync, so the two modes cannot drift
+
+# One statement per page, or one per IN chunk of the largest ?ids= request; sharded, up to one more per shard
+LIST_QUERY_BUDGET = -(-MULTIGET_MAX_IDS // MULTIGET_CHUNK_SIZE) + SHARD_COUNT
+
+def create_item(db: Session, item):
+    db_item = models.Item(
+        name=item.name,
+        description=item.description,
+        price=item.price
+    )
+    db.add(db_item)
+    db.flush()
+    changes.record(db, [db_item.id], "create")
+    db.commit()
+    db.refresh(db_item)
+    return db_item
+
+def read_item(db: Session, item_id, request, response, fields=None):
+    # With ?fields= only those columns are selected and the response carries just those keys
+    if_none_match = request.headers.get("if-none-match")
+    # A client reading its own writes from the primary skips the shared cache too
+    cached = None if wrote_recently(request) else item_cache.get(item_id)
+    if cached is not None:
+        # Revalidated from the cached version without touching the database
+        etag = etags.item_etag(item_id, cached["version"], fields)
+        if etags.matches(if_none_match, etag):
+            return etags.not_modified(etag)
+        if fields is not None:
+            return json_response(project(cached, fields), {"ETag": etag})
+        response.headers["ETag"] = etag
+        return cached
+    if if_none_match is not None:
+        # Compare the version alone before loading the whole row
+        version = db.query(models.Item.version).filter(models.Item.id == item_id).scalar()
+        if version is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        etag = etags.item_etag(item_id, version, fields)
+        if etags.matches(if_none_match, etag):
+            return etags.not_modified(etag)
+    if fields is not None:
+        row = db.query(*field_columns(fields, (models.Item.version,))).filter(models.Item.id == item_id).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        return json_response(project(row._mapping, fields), {"ETag": etags.item_etag(item_id, row.version, fields)})
+    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
+    if db_item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    item = ItemResponse.from_orm(db_item).dict()
+    if not from_replica(db):
+        # A lagging replica's row would be served to every client for the cache TTL
+        item_cache.fill(item_id, item, item["version"])
+    response.headers["ETag"] = etags.item_etag(item_id, item["version"])
+    return item
+
+def read_items_by_id(db: Session, raw_ids, request, response, fields=None):
+    # ?ids=3,1,2: one IN query per chunk for the ids the cache does not hold
+    try:
+        wanted = parse_ids(raw_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    found, misses = cached_items(wanted, use_cache=not wrote_recently(request))
+
+    def fetch(db, ids):
+        rows = {}
+        for chunk in chunked(ids):
+            if fields is not None:
+                # Partial rows are not cached
+                for row in db.query(*field_columns(fields, (models.Item.version,))).filter(models.Item.id.in_(chunk)):
+                    rows[row.id] = row._asdict()
+                continue
+            for db_item in db.query(models.Item).filter(models.Item.id.in_(chunk)):
+                item = ItemResponse.from_orm(db_item).dict()
+                if not from_replica(db):
+                    item_cache.fill(db_item.id, item, item["version"])
+                rows[db_item.id] = item
+        return rows
+
+    for rows in sharding.scatter_ids(misses, fetch) if SHARDED else [fetch(db, misses)]:
+        found.update(rows)
+    items, missing = in_request_order(wanted, found)
+    etag = etags.collection_etag(items, fields)
+    if etags.matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag)
+    headers = {"ETag": etag, **({"X-Missing-Ids": ",".join(map(str, missing))} if missing else {})}
+    if fields is not None:
+        return json_response([project(item, fields) for item in items], headers)
+    response.headers.update(headers)
+    return items
+
+def read_items(db: Session, request, response, skip=0, limit=10, cursor=None, sort="id", ids=None, fields=None):
+    # Pass the X-Next-Cursor header back as ?cursor= to page without OFFSET scans
+    if ids is not None:
+        return read_items_by_id(db, ids, request, response, fields)
+
+    def page_query(db):
+        if fields is not None:
+            return db.query(*field_columns(fields, (*SORT_KEYS[sort], models.Item.version)))
+        return db.query(*ITEM_COLUMNS) if FAST_JSON else db.query(models.Item)
+
+    try:
+        if SHARDED:
+            items = sharding.merged_page(page_query, sort, cursor, skip, limit)
+        else:
+            items = paginate(page_query(db), sort, cursor, skip, limit).all()
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The page is still queried, but an unchanged one is answered with a bodiless 304
+    etag = etags.collection_etag(items, fields)
+    if etags.matches(request.headers.get("if-none-match"), etag):
+        return etags.not_modified(etag)
+    cursor = next_cursor(items, sort, limit)
+    headers = {"ETag": etag, **({"X-Next-Cursor": cursor} if cursor else {})}
+    if fields is not None:
+        return json_response([project(row._mapping, fields) for row in items], headers)
+    if FAST_JSON:
+        return rows_response(items, headers)
+    response.headers.update(headers)
+    return items
+
+def update_item(db: Session, item_id, item, request, response):
+    # A single UPDATE ... RETURNING instead of SELECT, UPDATE and a refresh SELECT
+    values = item.dict()
+    expected = etags.if_match_versions(request.headers.get("if-match"), item_id)
+    stmt = (
+        update(models.Item)
+        .where(models.Item.id == item_id)
+        .values(**values, version=models.Item.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if expected is not None:
+        # Compare-and-swap on the version: no row lock is held while Python decides anything
+        stmt = stmt.where(models.Item.version.in_(expected))
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(stmt.returning(*models.Item.__table__.columns)).first()
+        db_item = row._asdict() if row is not None else None
+    elif db.execute(stmt).rowcount:
+        # PUT replaces every column, so only the new version has to be read back
+        version = db.query(models.Item.version).filter(models.Item.id == item_id).scalar()
+        db_item = {"id": item_id, "version": version, **values}
+    else:
+        db_item = None
+    if db_item is None:
+        db.rollback()
+        # Only a failed compare-and-swap needs a read to tell a stale version from a missing row
+        current = db.query(models.Item.version).filter(models.Item.id == item_id).scalar() if expected is not None else None
+        if current is not None:
+            raise etags.conflict(item_id, current)
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    changes.record(db, [item_id], "update")
+    db.commit()
+    # Readers may cache this version at once, but not one they loaded before the commit
+    item_cache.invalidate(item_id, db_item["version"])
+    response.headers["ETag"] = etags.item_etag(item_id, db_item["version"])
+    return db_item
+
+def delete_item(db: Session, item_id):
+    stmt = delete(models.Item).where(models.Item.id == item_id).execution_options(synchronize_session=False)
+    if db.get_bind().dialect.delete_returning:
+        deleted = db.execute(stmt.returning(models.Item.id)).first() is not None
+    else:
+        deleted = db.execute(stmt).rowcount > 0
+    if not deleted:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    changes.record(db, [item_id], "delete")
+    db.commit()
+    item_cache.invalidate(item_id)
+    return {"message": f"Item {item_id} deleted successfully"}
@@ -0,0 +1,288 @@
+import csv
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.exc import IntegrityError
+from pydantic import ValidationError
+from schemas import ItemCreate
+import models
+
+LOADER_CHUNK_ROWS = int(os.getenv("LOADER_CHUNK_ROWS", "50000"))
+
+FIELDS = ("name", "description", "price")
+# Mirrors float(): optional sign, digits with an optional fraction, optional exponent
+_NUMBER = r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$"
+
+class LoadError(ValueError):
+    pass
+
+def arrow_available():
+    try:
+        import pyarrow.compute  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def detect_format(path):
+    return "parquet" if path.endswith((".parquet", ".pq")) else "csv"
+
+# A chunk is (rows, rejects): rows are dicts ready to insert, rejects are (row number, error, original values)
+
+def _iter_arrow_batches(path, file_format, chunk_rows):
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+    if file_format == "parquet":
+        yield from pq.ParquetFile(path).iter_batches(batch_size=chunk_rows)
+        return
+    # Everything is read as text and converted below, so one bad price rejects a row, not the file
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=1 << 22),
+        convert_options=pacsv.ConvertOptions(
+            column_types={name: "string" for name in ("id", *FIELDS)}, strings_can_be_null=True, null_values=[""]
+        ),
+    )
+    for batch in reader:
+        for offset in range(0, batch.num_rows, chunk_rows):
+            yield batch.slice(offset, chunk_rows)
+
+def _as_float(values):
+    """float64 array with nulls wherever float() would have failed"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if pa.types.is_floating(values.type) or pa.types.is_integer(values.type):
+        return pc.cast(values, pa.float64())
+    values = pc.cast(values, pa.string())
+    numeric = pc.match_substring_regex(values, _NUMBER)
+    return pc.cast(pc.utf8_trim_whitespace(pc.if_else(numeric, values, None)), pa.float64())
+
+def _as_int(values):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if pa.types.is_integer(values.type):
+        return pc.cast(values, pa.int64())
+    values = pc.utf8_trim_whitespace(pc.cast(values, pa.string()))
+    return pc.cast(pc.if_else(pc.match_substring_regex(values, r"^[+-]?\d+$"), values, None), pa.int64())
+
+def _validate_batch(batch, first_row, keep_ids):
+    """Check a whole record batch at once with Arrow compute kernels, following ItemCreate's rules"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    names = batch.schema.names
+    null_text = pa.nulls(batch.num_rows, pa.string())
+    name = pc.cast(batch.column(names.index("name")), pa.string())
+    description = pc.cast(batch.column(names.index("description")), pa.string()) if "description" in names else null_text
+    price = _as_float(batch.column(names.index("price")))
+    columns = {"name": name, "description": description, "price": price}
+    # The first failing check names the reason; a null reason means the row is valid
+    reason = pc.if_else(price.is_valid(), null_text, "price: value is not a valid float")
+    if keep_ids:
+        columns["id"] = _as_int(batch.column(names.index("id")))
+        reason = pc.if_else(columns["id"].is_valid(), reason, "id: value is not a valid integer")
+    reason = pc.if_else(name.is_valid(), reason, "name: field required")
+
+    valid = reason.is_null()
+    rows = pa.table(columns).filter(valid).to_pylist()
+    rejects = []
+    if len(rows) < batch.num_rows:
+        bad = pc.indices_nonzero(pc.invert(valid))
+        for index, error, original in zip(
+            bad.to_pylist(), pc.take(reason, bad).to_pylist(), batch.take(bad).to_pylist()
+        ):
+            rejects.append((first_row + index, error, original))
+    return rows, rejects
+
+def _iter_arrow_chunks(path, file_format, chunk_rows, keep_ids):
+    first_row = 1
+    for batch in _iter_arrow_batches(path, file_format, chunk_rows):
+        missing = {"name", "price", *(("id",) if keep_ids else ())} - set(batch.schema.names)
+        if missing:
+            raise LoadError(f"{path} has no {', '.join(sorted(missing))} column")
+        yield _validate_batch(batch, first_row, keep_ids)
+        first_row += batch.num_rows
+
+def _iter_csv_chunks(path, chunk_rows, keep_ids):
+    """Row-at-a-time fallback for CSV when pyarrow is not installed"""
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        rows, rejects = [], []
+        for number, original in enumerate(reader, start=1):
+            values = {key: original.get(key) or None for key in FIELDS}
+            try:
+                row = ItemCreate(**values).dict()
+                if keep_ids:
+                    row["id"] = int(original.get("id") or "")
+            except ValidationError as e:
+                error = e.errors()[0]
+                rejects.append((number, f"{error['loc'][0]}: {error['msg']}", original))
+            except ValueError:
+                rejects.append((number, "id: value is not a valid integer", original))
+            else:
+                rows.append(row)
+            if number % chunk_rows == 0:
+                yield rows, rejects
+                rows, rejects = [], []
+        if rows or rejects:
+            yield rows, rejects
+
+def iter_chunks(path, file_format=None, chunk_rows=LOADER_CHUNK_ROWS, keep_ids=False):
+    file_format = file_format or detect_format(path)
+    if arrow_available():
+        return _iter_arrow_chunks(path, file_format, chunk_rows, keep_ids)
+    if file_format == "parquet":
+        raise LoadError("Loading Parquet needs pyarrow")
+    return _iter_csv_chunks(path, chunk_rows, keep_ids)
+
+def _mysql_text(value):
+    # LOAD DATA's default format: tab separated, backslash escapes, \N for NULL
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def load_data_infile(conn, rows, keys):
+    """Stage the rows in a temporary file and let the MySQL client stream it with LOAD DATA LOCAL INFILE"""
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", encoding="utf-8", delete=False) as f:
+        for row in rows:
+            f.write("\t".join(_mysql_text(row[key]) for key in keys) + "\n")
+    try:
+        path = f.name.replace("\\", "/").replace("'", "\\'")
+        result = conn.execute(text(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE items CHARACTER SET utf8mb4 ({', '.join(keys)})"
+        ))
+    finally:
+        os.unlink(f.name)
+    # LOCAL implies IGNORE: duplicate keys are skipped and bad values coerced, both only as warnings
+    warnings = [row for row in conn.execute(text("SHOW WARNINGS LIMIT 5")) if row[0] != "Note"]
+    if result.rowcount != len(rows) or warnings:
+        detail = "; ".join(row[2] for row in warnings)
+        raise LoadError(f"LOAD DATA stored {result.rowcount} of {len(rows)} rows{': ' + detail if detail else ''}")
+
+def write_chunk(conn, rows, method):
+    if not rows:
+        return
+    if method == "load-data":
+        load_data_infile(conn, rows, list(rows[0]))
+    else:
+        # No RETURNING, so SQLAlchemy hands the whole list to the driver's executemany
+        conn.execute(insert(models.Item.__table__), rows)
+
+def _secondary_indexes():
+    return sorted(models.Item.__table__.indexes, key=lambda index: index.name)
+
+def load(engine, chunks, method="executemany", rebuild_indexes=False, progress=None, on_rejects=None):
+    """Write validated chunks, one transaction each; returns (rows loaded, rows rejected, seconds)
+
+    Each chunk's rejects are handed to on_rejects as it is read, so none are held for the whole run.
+    Rows go straight into the table: the item triggers (search, stats) still fire, but the
+    change feed does not see them, as for any restore.
+    """
+    if rebuild_indexes:
+        # Maintaining the secondary indexes row by row costs more than one sort at the end
+        with engine.begin() as conn:
+            for index in _secondary_indexes():
+                index.drop(conn)
+    loaded = 0
+    rejected = 0
+    read = 0
+    start = time.perf_counter()
+    try:
+        for rows, bad in chunks:
+            first, read = read + 1, read + len(rows) + len(bad)
+            if on_rejects and bad:
+                on_rejects(bad)
+            rejected += len(bad)
+            try:
+                with engine.begin() as conn:
+                    write_chunk(conn, rows, method)
+            except (IntegrityError, LoadError) as e:
+                # Typically a --keep-ids row whose id is already taken; the chunk is rolled back, the ones before it stay committed
+                error = e.orig if isinstance(e, IntegrityError) else e
+                raise LoadError(f"rows {first}-{read}: {error}; the {loaded} rows loaded before them stay committed") from e
+            loaded += len(rows)
+            if progress:
+                progress(loaded, rejected, time.perf_counter() - start)
+    finally:
+        if rebuild_indexes:
+            with engine.begin() as conn:
+                for index in _secondary_indexes():
+                    index.create(conn)
+    return loaded, rejected, time.perf_counter() - start
+
+class RejectWriter:
+    """Reject CSV written a chunk at a time; the file is only created once a row is rejected"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def write(self, rejects):
+        for number, error, original in rejects:
+            if self._file is None:
+                # Every row of a file has the same columns, so the first reject's keys make the header
+                self._file = open(self.path, "w", newline="")
+                self._writer = csv.writer(self._file)
+                self._keys = list(original)
+                self._writer.writerow(["row", "error", *self._keys])
+            self._writer.writerow([number, error, *(original.get(key) for key in self._keys)])
+        self.count += len(rejects)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _report(loaded, rejected, seconds):
+    print(f"{loaded} rows loaded, {rejected} rejected, {loaded / seconds if seconds else 0:.0f} rows/s", file=sys.stderr)
+
+def main():
+    import argparse
+    # The database comes from DATABASE_URL, as for the app: DATABASE_URL=sqlite:///./test.db python loader.py items.csv
+    parser = argparse.ArgumentParser(description="Load items from a CSV or Parquet file")
+    parser.add_argument("input", help="file to read; the header must include name and price")
+    parser.add_argument("--format", choices=("csv", "parquet"), default=None, help="default: from the file extension")
+    parser.add_argument("--chunk-rows", type=int, default=LOADER_CHUNK_ROWS, help="rows validated and committed together")
+    parser.add_argument("--method", choices=("auto", "load-data", "executemany"), default="auto",
+                        help="auto uses LOAD DATA LOCAL INFILE on MySQL and executemany elsewhere")
+    parser.add_argument("--rebuild-indexes", action="store_true", help="drop the secondary indexes and rebuild them after the load")
+    parser.add_argument("--keep-ids", action="store_true", help="insert the file's id column instead of assigning new ids")
+    parser.add_argument("--rejects", default=None, help="CSV for rows that fail validation (default: <input>.rejects.csv)")
+    args = parser.parse_args()
+
+    import database
+    import etags
+
+    if database.shard_engines:
+        parser.error("DATABASE_SHARD_URLS is set: the loader writes one database; use POST /items/bulk, which routes rows to shards")
+    engine = database.engine
+    method = args.method
+    if method == "auto":
+        method = "load-data" if engine.dialect.name == "mysql" else "executemany"
+    if method == "load-data":
+        if engine.dialect.name != "mysql":
+            parser.error("--method load-data needs a MySQL database")
+        engine = create_engine(database.SQLALCHEMY_DATABASE_URL, connect_args={"allow_local_infile": True})
+    models.Base.metadata.create_all(bind=engine)
+    etags.ensure_version_column(engine)
+
+    rejects = RejectWriter(args.rejects or f"{args.input}.rejects.csv")
+    try:
+        with rejects:
+            chunks = iter_chunks(args.input, args.format, args.chunk_rows, args.keep_ids)
+            loaded, rejected, seconds = load(engine, chunks, method, args.rebuild_indexes, _report, rejects.write)
+    except LoadError as e:
+        sys.exit(f"error: {e}")
+    finally:
+        if rejects.count:
+            print(f"rejected rows written to {rejects.path}", file=sys.stderr)
+    _report(loaded, rejected, seconds)
+
+if __name__ == "__main__":
+    main()
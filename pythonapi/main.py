@@ -1,74 +1,308 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, Request, Response
+import asyncio
+import time
+from anyio import from_thread
+from concurrent.futures import ThreadPoolExecutor
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from pydantic import BaseModel
-from database import get_db, engine
+from typing import List, Literal, Optional
+from database import DB_ASYNC, DB_POOL_WARMUP, AsyncSessionLocal, SessionLocal, all_engines, async_engines, engine, get_read_db, get_write_db, pooled_engines, read_engine, shard_engines
+from schemas import ItemCreate, ItemResponse
+from batcher import WRITE_BATCHING, InsertBatcher
+from bulk import BULK_BATCH_SIZE, NDJSON_TYPES, BulkParseError, insert_batch, iter_json_array, iter_ndjson
+import admission
+import changes
+import etags
+import export
+import idempotency
+import items
+from fastjson import ITEM_COLUMNS, json_response
+from fields import field_columns, project, requested_fields
+import metrics
+import pool_stats
+import query_guard
+import search
+import sharding
+import stats
+from cache import item_cache
+from pagination import InvalidCursor
+from query_guard import query_budget
+from sharding import SHARD_COUNT, SHARDED, get_item_read_db, get_item_write_db
 import models
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+# Create database tables (replicas and shards too, so local SQLite files work out of the box)
+for db_engine in all_engines:
+    models.Base.metadata.create_all(bind=db_engine)
+    etags.ensure_version_column(db_engine)
+    search.ensure_index(db_engine)
+    stats.ensure_aggregates(db_engine)
+if SHARDED:
+    sharding.ensure_allocator()
 
 app = FastAPI()
 
-# Pydantic model for Item
-class ItemCreate(BaseModel):
-    name: str
-    description: Optional[str] = None
-    price: float
+if admission.ADMISSION_CONTROL:
+    # Inside the metrics middleware, so shed requests are counted as 503s
+    app.add_middleware(admission.AdmissionMiddleware, routes=app.router.routes)
+    if metrics.METRICS_ENABLED:
+        metrics.collectors.append(admission.render)
 
-class ItemResponse(ItemCreate):
-    id: int
+if idempotency.store is not None:
+    # Outside admission control, so replays and duplicates waiting on the first request hold no route slot
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    if metrics.METRICS_ENABLED:
+        metrics.collectors.append(idempotency.render)
 
-    class Config:
-        orm_mode = True
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    for db_engine in pooled_engines:
+        metrics.instrument_engine(db_engine)
+    metrics.collectors.append(lambda: metrics.gauges("item_cache", item_cache.stats()))
+    metrics.collectors.append(lambda: pool_stats.render(pooled_engines))
+
+if query_guard.QUERY_GUARD != "off":
+    app.add_middleware(query_guard.QueryGuardMiddleware)
+    for db_engine in pooled_engines:
+        query_guard.instrument_engine(db_engine)
+
+# Blocking item endpoints; async_items.router replaces them when DB_ASYNC is set
+router = APIRouter()
+
+def _insert_rows(rows):
+    with SessionLocal() as db:
+        return insert_batch(db, rows)
+
+# Own thread: request workers block on the batch, so flushing must not wait for a threadpool slot
+_flush_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="insert-batcher")
+
+async def _flush_inserts(rows):
+    return await asyncio.get_running_loop().run_in_executor(_flush_executor, _insert_rows, rows)
+
+insert_batcher = InsertBatcher(_flush_inserts) if WRITE_BATCHING and not DB_ASYNC else None
+
+@app.on_event("startup")
+async def warm_up_pools():
+    # Pay the connect cost here instead of on the first requests
+    for db_engine in all_engines:
+        pool_stats.warm_up(db_engine, DB_POOL_WARMUP)
+    for db_engine in async_engines:
+        await pool_stats.async_warm_up(db_engine, DB_POOL_WARMUP)
+
+@app.on_event("shutdown")
+async def dispose_engines():
+    if WRITE_BATCHING:
+        await items_batcher().drain()
+    for db_engine in all_engines:
+        db_engine.dispose()
+    for db_engine in async_engines:
+        await db_engine.dispose()
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to FastAPI Sample Application"}
 
-@app.post("/items/", response_model=ItemResponse)
-def create_item(item: ItemCreate, db: Session = Depends(get_db)):
-    db_item = models.Item(
-        name=item.name,
-        description=item.description,
-        price=item.price
+@app.post("/items/bulk")
+@query_budget(None)
+async def create_items_bulk(
+    request: Request,
+    batch_size: int = Query(BULK_BATCH_SIZE, ge=1, le=10000),
+    db: Session = Depends(get_write_db),
+):
+    # Body is a JSON array, or one item per line with an NDJSON content type
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    parse = iter_ndjson if content_type in NDJSON_TYPES else iter_json_array
+    write = sharding.insert_items if SHARDED else lambda rows: insert_batch(db, rows)
+
+    ids = []
+    batch = []
+    try:
+        async for row in parse(request.stream()):
+            try:
+                batch.append(ItemCreate.parse_obj(row).dict())
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail={"row": len(ids) + len(batch), "errors": e.errors(), "inserted_ids": ids},
+                )
+            if len(batch) >= batch_size:
+                ids += await run_in_threadpool(write, batch)
+                batch = []
+    except BulkParseError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e), "inserted_ids": ids})
+    if batch:
+        ids += await run_in_threadpool(write, batch)
+    return {"count": len(ids), "ids": ids}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/pool/stats")
+def read_pool_stats():
+    return {db_engine.pool._orig_logging_name: pool_stats.pool_stats(db_engine) for db_engine in pooled_engines}
+
+@app.get("/cache/stats")
+def cache_stats():
+    # Hit/miss/eviction counters for sizing CACHE_MAX_ITEMS and CACHE_TTL_SECONDS
+    return item_cache.stats()
+
+@app.get("/items/export")
+@query_budget(None)
+def export_items(request: Request, format: Literal["ndjson", "csv", "arrow", "parquet"] = "ndjson"):
+    # Rows are streamed a chunk at a time, from a server-side cursor or by id pages where the driver
+    # buffers whole results, so memory does not grow with the table; sharded, the shards are merged by id
+    if format in export.COLUMNAR_FORMATS and not export.arrow_available():
+        raise HTTPException(status_code=501, detail=f"{format} export needs pyarrow installed")
+    stream, media_type = export.FORMATS[format]
+    return StreamingResponse(
+        stream(shard_engines if SHARDED else read_engine(request)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="items.{format}"'},
     )
-    db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
-    return db_item
-
-@app.get("/items/{item_id}", response_model=ItemResponse)
-def read_item(item_id: int, db: Session = Depends(get_db)):
-    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
-    if db_item is None:
-        raise HTTPException(status_code=404, detail="Item not found")
-    return db_item
-
-@app.get("/items/", response_model=List[ItemResponse])
-def read_items(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    items = db.query(models.Item).offset(skip).limit(limit).all()
-    return items
-
-@app.put("/items/{item_id}", response_model=ItemResponse)
-def update_item(item_id: int, item: ItemCreate, db: Session = Depends(get_db)):
-    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
-    if db_item is None:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    for key, value in item.dict().items():
-        setattr(db_item, key, value)
-    
-    db.commit()
-    db.refresh(db_item)
-    return db_item
-
-@app.delete("/items/{item_id}")
-def delete_item(item_id: int, db: Session = Depends(get_db)):
-    db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
-    if db_item is None:
-        raise HTTPException(status_code=404, detail="Item not found")
-    
-    db.delete(db_item)
-    db.commit()
-    return {"message": f"Item {item_id} deleted successfully"}
+
+@app.get("/items/stats")
+@query_budget(max(1, SHARD_COUNT))
+def read_item_stats(db: Session = Depends(get_read_db)):
+    # Served from the trigger-maintained histogram, so the cost does not grow with the table
+    try:
+        return sharding.merged_stats() if SHARDED else stats.read_stats(db)
+    except stats.StatsUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+@app.post("/items/stats/rebuild")
+def rebuild_item_stats(dry_run: bool = False):
+    # Consistency check: full scan of items compared with the stored aggregates, which are then replaced
+    try:
+        found = {}
+        for db_engine in shard_engines or (engine,):
+            with db_engine.begin() as conn:
+                found[db_engine.pool._orig_logging_name] = stats.rebuild(conn, dry_run)
+    except stats.StatsUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    # Sharded drift is reported per shard
+    drift = {name: shard_drift for name, shard_drift in found.items() if shard_drift} if SHARDED else found["primary"]
+    return {"consistent": not drift, "rebuilt": not dry_run, "drift": drift}
+
+@app.get("/items/search", response_model=List[ItemResponse])
+@query_budget(max(1, SHARD_COUNT))
+def search_items(
+    response: Response,
+    q: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=search.SEARCH_MAX_LIMIT),
+    fields: Optional[tuple] = Depends(requested_fields),
+    db: Session = Depends(get_read_db),
+):
+    # Every word matches as a prefix of a word in name or description; pass X-Next-Cursor back as ?cursor=
+    columns = ITEM_COLUMNS if fields is None else field_columns(fields)
+    try:
+        if SHARDED:
+            rows, cursor = sharding.merged_search(q, cursor, limit, columns)
+        else:
+            rows, cursor = search.search(db, q, cursor, limit, columns)
+    except (search.InvalidSearch, InvalidCursor) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except search.SearchUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    if fields is not None:
+        return json_response([project(row._mapping, fields) for row in rows], {"X-Next-Cursor": cursor} if cursor else None)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return rows
+
+async def _fetch_changes(since, limit):
+    # Primary only: a lagging replica would answer a woken long-poll with nothing
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(changes.fetch, since, limit)
+
+    def fetch():
+        with SessionLocal() as db:
+            return changes.fetch(db, since, limit)
+    return await run_in_threadpool(fetch)
+
+@app.get("/items/changes")
+@query_budget(None)
+async def read_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=changes.CHANGES_MAX_LIMIT),
+    wait: float = Query(0, ge=0, le=changes.CHANGES_MAX_WAIT_SECONDS),
+):
+    # Pass next_since back as ?since=; with ?wait= an empty answer is held until a write commits
+    if SHARDED:
+        # Each shard numbers its own change log, so there is no single sequence to page through
+        raise HTTPException(status_code=501, detail="The change feed is not supported with DATABASE_SHARD_URLS")
+    deadline = time.monotonic() + wait
+    while True:
+        version = changes.change_notifier.version
+        found = await _fetch_changes(since, limit)
+        remaining = deadline - time.monotonic()
+        if found or remaining <= 0:
+            break
+        await changes.change_notifier.wait(version, min(remaining, changes.CHANGES_POLL_SECONDS))
+    return {"changes": found, "next_since": found[-1]["seq"] if found else since}
+
+@router.post("/items/", response_model=ItemResponse)
+@query_budget(3)
+def create_item(item: ItemCreate, db: Session = Depends(get_write_db)):
+    if SHARDED:
+        return sharding.create_item(item.dict())
+    if insert_batcher is not None:
+        # Group commit: this worker waits until the batch holding the row is committed
+        values = item.dict()
+        return {"id": from_thread.run(insert_batcher.submit, values), "version": 1, **values}
+    return items.create_item(db, item)
+
+@router.get("/items/{item_id}", response_model=ItemResponse)
+@query_budget(2)
+def read_item(
+    item_id: int,
+    request: Request,
+    response: Response,
+    fields: Optional[tuple] = Depends(requested_fields),
+    db: Session = Depends(get_item_read_db),
+):
+    return items.read_item(db, item_id, request, response, fields)
+
+@router.get("/items/", response_model=List[ItemResponse])
+@query_budget(items.LIST_QUERY_BUDGET)
+def read_items(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    sort: Literal["id", "price"] = "id",
+    ids: Optional[str] = None,
+    fields: Optional[tuple] = Depends(requested_fields),
+    db: Session = Depends(get_read_db),
+):
+    return items.read_items(db, request, response, skip, limit, cursor, sort, ids, fields)
+
+@router.put("/items/{item_id}", response_model=ItemResponse)
+@query_budget(3)
+def update_item(item_id: int, item: ItemCreate, request: Request, response: Response, db: Session = Depends(get_item_write_db)):
+    return items.update_item(db, item_id, item, request, response)
+
+@router.delete("/items/{item_id}")
+@query_budget(2)
+def delete_item(item_id: int, db: Session = Depends(get_item_write_db)):
+    return items.delete_item(db, item_id)
+
+def items_batcher():
+    if DB_ASYNC:
+        from async_items import insert_batcher as batcher
+        return batcher
+    return insert_batcher
+
+# Included last so fixed paths registered on the app win over /items/{item_id}
+if DB_ASYNC:
+    from async_items import router as items_router
+else:
+    items_router = router
+app.include_router(items_router)
+
+if metrics.METRICS_ENABLED and WRITE_BATCHING:
+    metrics.collectors.append(lambda: metrics.gauges("insert_batcher", items_batcher().stats()))
@@ -0,0 +1,156 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+from sqlalchemy import event
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def totals(self, labels):
+        """(count, sum) of the observations recorded under `labels`"""
+        series = self._series.get(labels)
+        if series is None:
+            return 0, 0.0
+        return sum(series[0]), series[1]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            label_text = _labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text}{"," if label_text else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._series = {}
+
+    def inc(self, labels, value=1):
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{{{_labels(labels)}}} {value}")
+        return lines
+
+def _labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time from request start to the last response byte")
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time each request spent executing SQL")
+REQUEST_APP_SECONDS = Histogram(
+    "http_request_app_seconds", "Time each request spent outside SQL (framework, validation, serialization)"
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per request", buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+)
+REQUESTS = Counter("http_requests_total", "Requests by route and status code")
+
+# Extra line producers for /metrics, e.g. cache counters; each returns a list of lines
+collectors = []
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+# Mutable per-request stats; threadpool workers get a copy of the context, so they share the object
+current_request = contextvars.ContextVar("current_request", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+def instrument_engine(engine):
+    """Attribute SQL time and statement count on `engine` to the current request"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware; per-route labels use the matched path template, not the raw URL"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            route = scope.get("route")
+            labels = (("method", scope["method"]), ("route", route.path if route is not None else "unmatched"))
+            REQUEST_SECONDS.observe(labels, elapsed)
+            REQUEST_DB_SECONDS.observe(labels, stats.db_seconds)
+            REQUEST_APP_SECONDS.observe(labels, max(elapsed - stats.db_seconds, 0.0))
+            REQUEST_QUERIES.observe(labels, stats.queries)
+            REQUESTS.inc(labels + (("status", str(status)),))
+
+def gauges(prefix, values):
+    """Lines for each numeric entry of `values` as a gauge named <prefix>_<key>"""
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines += [f"# TYPE {prefix}_{key} gauge", f"{prefix}_{key} {value}"]
+    return lines
+
+def render():
+    lines = []
+    for metric in (REQUESTS, REQUEST_SECONDS, REQUEST_DB_SECONDS, REQUEST_APP_SECONDS, REQUEST_QUERIES):
+        lines += metric.render()
+    for collect in collectors:
+        lines += collect()
+    return "\n".join(lines) + "\n"
@@ -1,10 +1,45 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, Index
 from database import Base
 
 class Item(Base):
     __tablename__ = "items"
+    # Supports keyset pagination ordered by (price, id)
+    __table_args__ = (Index("ix_items_price_id", "price", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     description = Column(String, nullable=True)
     price = Column(Float)
+    # Bumped by every update; feeds the item ETag
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+class ItemChange(Base):
+    """Append-only change log behind GET /items/changes; seq orders the feed
+
+    Nothing prunes it: retention is unbounded, and a consumer can resume from any seq
+    ever handed out. Trim old rows yourself if the table grows too large.
+    """
+    __tablename__ = "item_changes"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    item_id = Column(Integer, nullable=False)
+    op = Column(String(6), nullable=False)  # create | update | delete
+
+class ItemPriceBucket(Base):
+    """Price histogram kept current by triggers on items; see stats.py"""
+    __tablename__ = "item_price_buckets"
+
+    # -1 holds items without a price; bucket i counts prices below upper_bound (None: no upper bound)
+    bucket = Column(Integer, primary_key=True, autoincrement=False)
+    # Each bucket is spread over STATS_STRIPES rows that writers update independently; reads sum them
+    stripe = Column(Integer, primary_key=True, autoincrement=False, default=0)
+    upper_bound = Column(Float, nullable=True)
+    item_count = Column(Integer, nullable=False, default=0)
+    price_sum = Column(Float, nullable=False, default=0.0)
+
+class IdBlock(Base):
+    """Hi-lo id allocator for sharded items: each process reserves a block of ids per round trip"""
+    __tablename__ = "id_blocks"
+
+    name = Column(String(32), primary_key=True)
+    next_id = Column(Integer, nullable=False)
@@ -0,0 +1,41 @@
+import os
+from cache import item_cache
+
+MULTIGET_MAX_IDS = int(os.getenv("MULTIGET_MAX_IDS", "1000"))
+# Keeps each IN (...) list well under driver and planner limits
+MULTIGET_CHUNK_SIZE = int(os.getenv("MULTIGET_CHUNK_SIZE", "500"))
+
+def parse_ids(raw):
+    """Parse ?ids=3,1,2 into a de-duplicated list that keeps the requested order"""
+    try:
+        ids = [int(part) for part in raw.split(",") if part.strip()]
+    except ValueError:
+        raise ValueError("ids must be a comma-separated list of integers")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MULTIGET_MAX_IDS:
+        raise ValueError(f"At most {MULTIGET_MAX_IDS} ids per request")
+    return ids
+
+def cached_items(ids, use_cache=True):
+    """Split ids into items already in the item cache and ids that must be queried"""
+    if not use_cache:
+        return {}, list(ids)
+    found = {}
+    misses = []
+    for item_id in ids:
+        cached = item_cache.get(item_id)
+        if cached is None:
+            misses.append(item_id)
+        else:
+            found[item_id] = cached
+    return found, misses
+
+def chunked(ids, size=MULTIGET_CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def in_request_order(ids, found):
+    """Items in the order they were asked for, plus the ids that do not exist"""
+    items = [found[item_id] for item_id in ids if item_id in found]
+    missing = [item_id for item_id in ids if item_id not in found]
+    return items, missing
@@ -0,0 +1,57 @@
+import base64
+import json
+from sqlalchemy import and_, or_
+import models
+
+# Keyset orderings for GET /items/; the last column is always the unique id tiebreaker
+SORT_KEYS = {
+    "id": (models.Item.id,),
+    "price": (models.Item.price, models.Item.id),
+}
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_values(sort, values):
+    """Opaque cursor holding the sort-key values of the last row served"""
+    raw = json.dumps({"s": sort, "v": list(values)}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def encode_cursor(sort, item):
+    """Opaque cursor pointing just past `item` in the given ordering"""
+    return encode_values(sort, [getattr(item, column.key) for column in SORT_KEYS[sort]])
+
+def decode_cursor(sort, cursor, size=None):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        values = data["v"]
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor("Malformed cursor")
+    size = len(SORT_KEYS[sort]) if size is None else size
+    if data.get("s") != sort or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(f"Cursor does not belong to sort={sort}")
+    return values
+
+def keyset_after(columns, values):
+    # (a, b) > (x, y) written as a >= x AND (a > x OR b > y) so the leading column bounds an index range
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column > value
+    return and_(column >= value, or_(column > value, keyset_after(columns[1:], values[1:])))
+
+def paginate(query, sort="id", cursor=None, skip=0, limit=10):
+    """Apply keyset (cursor) or legacy offset pagination to a Query or select()"""
+    columns = SORT_KEYS[sort]
+    query = query.order_by(*columns)
+    if cursor:
+        query = query.filter(keyset_after(columns, decode_cursor(sort, cursor)))
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def next_cursor(items, sort, limit):
+    """Cursor for the following page, or None when this page was the last"""
+    if limit <= 0 or len(items) < limit:
+        return None
+    return encode_cursor(sort, items[-1])
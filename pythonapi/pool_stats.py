@@ -0,0 +1,90 @@
+import time
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from metrics import Histogram
+
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+POOL_CONNECT_SECONDS = Histogram("db_pool_connect_seconds", "Time to open a new database connection")
+
+def _labels(pool):
+    return (("pool", pool._orig_logging_name or "default"),)
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout wait and connect latency, labelled by pool_logging_name"""
+
+    # _do_get and _create_connection are the QueuePool internals every checkout and new connection go through
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(_labels(self), time.perf_counter() - start)
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        connection = super()._create_connection()
+        POOL_CONNECT_SECONDS.observe(_labels(self), time.perf_counter() - start)
+        return connection
+
+class InstrumentedAsyncAdaptedQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """InstrumentedQueuePool for AsyncEngines; the pool itself runs under the engine's sync_engine"""
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            timeout=pool.timeout(),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        waits, wait_seconds = POOL_WAIT_SECONDS.totals(_labels(pool))
+        connects, connect_seconds = POOL_CONNECT_SECONDS.totals(_labels(pool))
+        stats.update(
+            checkouts=waits,
+            wait_seconds_total=round(wait_seconds, 6),
+            connects=connects,
+            connect_seconds_total=round(connect_seconds, 6),
+        )
+    return stats
+
+def render(engines):
+    """Prometheus lines for live pool gauges plus the wait/connect histograms"""
+    lines = []
+    for key in ("size", "checked_in", "checked_out", "overflow"):
+        lines.append(f"# TYPE db_pool_{key} gauge")
+        for engine in engines:
+            stats = pool_stats(engine)
+            if key in stats:
+                lines.append(f'db_pool_{key}{{pool="{engine.pool._orig_logging_name}"}} {stats[key]}')
+    return lines + POOL_WAIT_SECONDS.render() + POOL_CONNECT_SECONDS.render()
+
+def warm_up(engine, count):
+    """Open up to `count` connections (capped at the pool size) so early requests skip the connect cost"""
+    count = min(count, engine.pool.size()) if isinstance(engine.pool, QueuePool) else count
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+async def async_warm_up(engine, count):
+    """warm_up() for an AsyncEngine"""
+    count = min(count, engine.pool.size()) if isinstance(engine.pool, QueuePool) else count
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(await engine.connect())
+    finally:
+        for connection in connections:
+            await connection.close()
+    return len(connections)
@@ -0,0 +1,95 @@
+import collections
+import contextvars
+import logging
+import os
+import re
+from sqlalchemy import event
+
+# Development/CI check on the statements each request issues: off | warn | raise
+QUERY_GUARD = os.getenv("QUERY_GUARD", "off").lower()
+QUERY_GUARD_DEFAULT_BUDGET = int(os.getenv("QUERY_GUARD_DEFAULT_BUDGET", "20"))
+# The same statement shape repeated more often than this is reported as a likely N+1
+QUERY_GUARD_MAX_DUPLICATES = int(os.getenv("QUERY_GUARD_MAX_DUPLICATES", "5"))
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+def query_budget(limit):
+    """Per-route statement budget; place under the route decorator. None exempts the route from the guard"""
+    def decorate(func):
+        func.query_budget = limit
+        return func
+    return decorate
+
+_PARAM = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_PARAM_LIST = re.compile(rf"\(\s*{_PARAM}(?:\s*,\s*{_PARAM})*\s*\)(?:\s*,\s*\(\s*{_PARAM}(?:\s*,\s*{_PARAM})*\s*\))*")
+
+def statement_shape(statement):
+    """Statement text with parameter lists and whitespace collapsed, so IN (?, ?) == IN (?)"""
+    return " ".join(_PARAM_LIST.sub("(?)", statement).split())
+
+class RequestQueries:
+    def __init__(self, scope):
+        self.scope = scope
+        self.count = 0
+        self.shapes = collections.Counter()
+        self.reported = set()
+
+    @property
+    def route(self):
+        route = self.scope.get("route")
+        return f'{self.scope["method"]} {route.path if route is not None else self.scope["path"]}'
+
+    @property
+    def budget(self):
+        return getattr(self.scope.get("endpoint"), "query_budget", QUERY_GUARD_DEFAULT_BUDGET)
+
+current_queries = contextvars.ContextVar("current_queries", default=None)
+
+def _report(queries, kind, message):
+    if QUERY_GUARD == "raise":
+        raise QueryBudgetExceeded(message)
+    if kind not in queries.reported:
+        queries.reported.add(kind)
+        logger.warning(message)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    queries = current_queries.get()
+    if queries is None:
+        return
+    budget = queries.budget
+    if budget is None:
+        return
+    queries.count += 1
+    shape = statement_shape(statement)
+    queries.shapes[shape] += 1
+
+    if queries.count > budget:
+        _report(queries, "budget", f"{queries.route} issued {queries.count} SQL statements, budget is {budget}")
+    if queries.shapes[shape] > QUERY_GUARD_MAX_DUPLICATES:
+        _report(
+            queries,
+            shape,
+            f"{queries.route} ran the same statement {queries.shapes[shape]} times (likely N+1): {shape[:200]}",
+        )
+
+def instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+
+class QueryGuardMiddleware:
+    """Tracks the statements issued while serving each HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_queries.set(RequestQueries(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_queries.reset(token)
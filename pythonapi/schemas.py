@@ -0,0 +1,15 @@
+from typing import Optional
+from pydantic import BaseModel
+
+# Pydantic model for Item
+class ItemCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    price: float
+
+class ItemResponse(ItemCreate):
+    id: int
+    version: int
+
+    class Config:
+        orm_mode = True
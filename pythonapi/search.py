@@ -0,0 +1,92 @@
+import os
+import re
+from sqlalchemy import column, func, inspect, literal_column, select, table, text
+from sqlalchemy.dialects import mysql
+from fastjson import ITEM_COLUMNS
+from pagination import decode_cursor, encode_values, keyset_after
+import models
+
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+# bm25 column weights on SQLite: a hit in the name counts for more than one in the description
+SEARCH_NAME_WEIGHT = float(os.getenv("SEARCH_NAME_WEIGHT", "10"))
+SEARCH_DESCRIPTION_WEIGHT = float(os.getenv("SEARCH_DESCRIPTION_WEIGHT", "1"))
+
+MYSQL_INDEX = "ft_items_name_description"
+
+class SearchUnavailable(RuntimeError):
+    pass
+
+class InvalidSearch(ValueError):
+    pass
+
+# External-content FTS5 table over items; triggers keep it in step with every write path
+_SQLITE_DDL = (
+    """CREATE VIRTUAL TABLE items_fts USING fts5(
+        name, description, content='items', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER items_fts_insert AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER items_fts_delete AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER items_fts_update AFTER UPDATE OF name, description ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    # Index rows written before the FTS table existed
+    "INSERT INTO items_fts(items_fts) VALUES ('rebuild')",
+)
+
+def ensure_index(engine):
+    """Create the text index next to the items table if it is missing"""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'")).first() is None:
+                for statement in _SQLITE_DDL:
+                    conn.execute(text(statement))
+    elif engine.dialect.name == "mysql":
+        if MYSQL_INDEX not in {index["name"] for index in inspect(engine).get_indexes("items")}:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE items ADD FULLTEXT INDEX {MYSQL_INDEX} (name, description)"))
+
+def _terms(q):
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        raise InvalidSearch("Search needs at least one word")
+    return terms
+
+_fts = table("items_fts", column("rowid"))
+
+def _search_query(dialect, q, columns):
+    """(select, score) for items matching every term of q as a prefix; lower score ranks first"""
+    if dialect == "sqlite":
+        # Quoted terms keep FTS5 operators in user input literal
+        match = " ".join(f'"{term}"*' for term in _terms(q))
+        fts = literal_column("items_fts")
+        score = func.bm25(fts, SEARCH_NAME_WEIGHT, SEARCH_DESCRIPTION_WEIGHT)
+        query = (
+            select(*columns, score.label("score"))
+            .select_from(_fts.join(models.Item, models.Item.id == _fts.c.rowid))
+            .where(fts.op("MATCH")(match))
+        )
+        return query, score
+    if dialect == "mysql":
+        against = mysql.match(
+            models.Item.name, models.Item.description, against=" ".join(f"+{term}*" for term in _terms(q))
+        ).in_boolean_mode()
+        score = -against
+        return select(*columns, score.label("score")).where(against), score
+    raise SearchUnavailable(f"Search is not supported on {dialect}")
+
+def search(db, q, cursor=None, limit=20, columns=ITEM_COLUMNS):
+    """Best matches first as (rows, next cursor); the cursor is (score, id) of the last row"""
+    query, score = _search_query(db.get_bind().dialect.name, q, columns)
+    keys = (score, models.Item.id)
+    if cursor:
+        # Scores shift a little as the index changes, so a page boundary is only approximately stable under writes
+        query = query.where(keyset_after(keys, decode_cursor("search", cursor, len(keys))))
+    rows = db.execute(query.order_by(*keys).limit(limit)).all()
+    next_cursor = encode_values("search", (rows[-1].score, rows[-1].id)) if len(rows) == limit else None
+    return rows, next_cursor
@@ -0,0 +1,161 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Request, Response
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from bulk import insert_batch
+from database import SessionLocal, engine, get_read_db, get_write_db, shard_engines
+from pagination import SORT_KEYS, encode_values, paginate
+import models
+import search
+import stats
+
+SHARDED = bool(shard_engines)
+SHARD_COUNT = len(shard_engines)
+# Ids reserved from the allocator row per round trip to the primary
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "100"))
+# Threads running per-shard queries for scatter-gather reads, shared by all requests
+SHARD_FANOUT_THREADS = int(os.getenv("SHARD_FANOUT_THREADS", str(4 * max(1, SHARD_COUNT))))
+
+ALLOCATOR = "items"
+
+def shard_index(item_id):
+    # crc32 rather than hash(): the placement has to agree across processes and restarts
+    return zlib.crc32(item_id.to_bytes(8, "little", signed=True)) % SHARD_COUNT
+
+def engine_for(item_id):
+    return shard_engines[shard_index(item_id)]
+
+# Dependencies for handlers that touch one item: its shard when sharded, the usual session otherwise
+def get_item_read_db(item_id: int, request: Request):
+    if not SHARDED:
+        yield from get_read_db(request)
+        return
+    with SessionLocal(bind=engine_for(item_id)) as db:
+        yield db
+
+def get_item_write_db(item_id: int, response: Response):
+    if not SHARDED:
+        yield from get_write_db(response)
+        return
+    with SessionLocal(bind=engine_for(item_id)) as db:
+        yield db
+
+class IdAllocator:
+    """Globally unique item ids: blocks are reserved from one row on the primary, then handed out locally"""
+
+    def __init__(self, block=SHARD_ID_BLOCK):
+        self.block = block
+        self._next = 0
+        self._limit = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, size):
+        table = models.IdBlock
+        with engine.begin() as conn:
+            # The UPDATE takes the row lock, so the read back sees only this reservation
+            conn.execute(update(table).where(table.name == ALLOCATOR).values(next_id=table.next_id + size))
+            end = conn.scalar(select(table.next_id).where(table.name == ALLOCATOR))
+        return end - size, end
+
+    def allocate(self, count=1):
+        with self._lock:
+            if self._next + count > self._limit:
+                # Amortised over a whole block, so it is kept out of the request's query budget
+                self._next, self._limit = contextvars.Context().run(self._reserve, max(count, self.block))
+            start = self._next
+            self._next += count
+        return list(range(start, start + count))
+
+id_allocator = IdAllocator()
+
+def ensure_allocator():
+    """Create the allocator row, starting past every id already stored on the shards"""
+    table = models.IdBlock
+    with engine.begin() as conn:
+        if conn.scalar(select(table.next_id).where(table.name == ALLOCATOR)) is not None:
+            return
+    start = 1
+    for shard in shard_engines:
+        with shard.connect() as conn:
+            start = max(start, 1 + conn.scalar(select(func.coalesce(func.max(models.Item.id), 0))))
+    try:
+        with engine.begin() as conn:
+            conn.execute(table.__table__.insert().values(name=ALLOCATOR, next_id=start))
+    except IntegrityError:
+        # Another process created it first
+        pass
+
+_fanout_executor = ThreadPoolExecutor(max_workers=SHARD_FANOUT_THREADS, thread_name_prefix="shard-fanout")
+
+def scatter(fn, engines=None):
+    """fn(db) on each shard (None: all) concurrently, one session per shard; results in the order of `engines`"""
+    def run(shard):
+        with SessionLocal(bind=shard) as db:
+            return fn(db)
+
+    # Each task carries the request's context, so the query guard counts the fan-out statements
+    futures = [_fanout_executor.submit(contextvars.copy_context().run, run, shard) for shard in (shard_engines if engines is None else engines)]
+    return [future.result() for future in futures]
+
+def scatter_ids(ids, fn):
+    """fn(db, ids) on just the shards holding `ids`, each given its own share"""
+    groups = {}
+    for item_id in ids:
+        groups.setdefault(engine_for(item_id), []).append(item_id)
+    return scatter(lambda db: fn(db, groups[db.get_bind()]), list(groups))
+
+def insert_items(rows):
+    """insert_batch across shards with allocator ids; each shard commits on its own, so a failure can leave others written"""
+    ids = id_allocator.allocate(len(rows))
+    by_id = {item_id: {"id": item_id, **row} for item_id, row in zip(ids, rows)}
+    scatter_ids(ids, lambda db, shard_ids: insert_batch(db, [by_id[item_id] for item_id in shard_ids]))
+    return ids
+
+def create_item(values):
+    item_id = id_allocator.allocate()[0]
+    with SessionLocal(bind=engine_for(item_id)) as db:
+        insert_batch(db, [{"id": item_id, **values}])
+    return {"id": item_id, "version": 1, **values}
+
+def _nulls_first(values):
+    # Matches the databases' ascending order, where NULL sorts before any price
+    return tuple((value is not None, value) for value in values)
+
+def merged_page(make_query, sort="id", cursor=None, skip=0, limit=10):
+    """paginate() over every shard: each returns its first skip + limit rows and the merge keeps the global window"""
+    keys = [column.key for column in SORT_KEYS[sort]]
+    skip = 0 if cursor else skip
+    parts = scatter(lambda db: paginate(make_query(db), sort, cursor, 0, skip + limit).all())
+    merged = heapq.merge(*parts, key=lambda row: _nulls_first(getattr(row, key) for key in keys))
+    return list(itertools.islice(merged, skip, skip + limit))
+
+def merged_search(q, cursor, limit, columns):
+    """search.search() on every shard merged by (score, id); bm25 weighs terms by per-shard statistics, so ranks are approximate"""
+    parts = scatter(lambda db: search.search(db, q, cursor, limit, columns)[0])
+    rows = list(itertools.islice(heapq.merge(*parts, key=lambda row: (row.score, row.id)), limit))
+    next_cursor = encode_values("search", (rows[-1].score, rows[-1].id)) if len(rows) == limit else None
+    return rows, next_cursor
+
+def merged_stats():
+    """stats.read_stats() summed over the shards; they share STATS_PRICE_BUCKETS, so histograms add up bucket by bucket"""
+    parts = scatter(stats.read_stats)
+    priced = sum(part["priced"] for part in parts)
+    price_sum = sum(part["avg_price"] * part["priced"] for part in parts if part["priced"])
+    prices = [part for part in parts if part["priced"]]
+    return {
+        "count": sum(part["count"] for part in parts),
+        "priced": priced,
+        "min_price": min((part["min_price"] for part in prices), default=None),
+        "max_price": max((part["max_price"] for part in prices), default=None),
+        "avg_price": price_sum / priced if priced else None,
+        "histogram": [
+            {"lt": buckets[0]["lt"], "count": sum(bucket["count"] for bucket in buckets)}
+            for buckets in zip(*(part["histogram"] for part in parts))
+        ],
+    }
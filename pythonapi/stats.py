@@ -0,0 +1,181 @@
+import os
+from sqlalchemy import case, delete, func, insert, inspect, select, text
+import models
+
+# Upper bounds of the price histogram buckets; a final bucket takes everything above the last one
+STATS_PRICE_BUCKETS = tuple(
+    float(bound) for bound in os.getenv("STATS_PRICE_BUCKETS", "1,5,10,25,50,100,250,500,1000").split(",") if bound.strip()
+)
+
+# Rows per bucket on MySQL: a writer's trigger updates the stripe of its connection, so concurrent
+# transactions rarely wait on one another's row locks. SQLite has one writer and keeps a single stripe
+STATS_STRIPES = int(os.getenv("STATS_STRIPES", "16"))
+
+TRIGGERS = ("item_stats_insert", "item_stats_delete", "item_stats_update")
+
+class StatsUnavailable(RuntimeError):
+    pass
+
+def _bounds():
+    return list(STATS_PRICE_BUCKETS) + [None]
+
+def _stripes(dialect):
+    return STATS_STRIPES if dialect == "mysql" else 1
+
+def _bucket_sql(price):
+    # Bounds are floats from our own config, so inlining them as literals is safe
+    whens = " ".join(f"WHEN {price} < {bound!r} THEN {i}" for i, bound in enumerate(STATS_PRICE_BUCKETS))
+    return f"CASE WHEN {price} IS NULL THEN -1 {whens} ELSE {len(STATS_PRICE_BUCKETS)} END"
+
+def _bucket_expr(price):
+    return case(
+        (price.is_(None), -1),
+        *((price < bound, i) for i, bound in enumerate(STATS_PRICE_BUCKETS)),
+        else_=len(STATS_PRICE_BUCKETS),
+    )
+
+def _apply(row, sign, dialect):
+    op = "+" if sign > 0 else "-"
+    stripe = f"CONNECTION_ID() % {STATS_STRIPES}" if _stripes(dialect) > 1 else "0"
+    return (
+        f"UPDATE item_price_buckets SET item_count = item_count {op} 1, "
+        f"price_sum = price_sum {op} COALESCE({row}.price, 0) "
+        f"WHERE bucket = {_bucket_sql(f'{row}.price')} AND stripe = {stripe}"
+    )
+
+def _trigger_ddl(dialect):
+    if dialect == "sqlite":
+        return (
+            f"CREATE TRIGGER item_stats_insert AFTER INSERT ON items BEGIN {_apply('NEW', 1, dialect)}; END",
+            f"CREATE TRIGGER item_stats_delete AFTER DELETE ON items BEGIN {_apply('OLD', -1, dialect)}; END",
+            "CREATE TRIGGER item_stats_update AFTER UPDATE OF price ON items WHEN OLD.price IS NOT NEW.price "
+            f"BEGIN {_apply('OLD', -1, dialect)}; {_apply('NEW', 1, dialect)}; END",
+        )
+    return (
+        f"CREATE TRIGGER item_stats_insert AFTER INSERT ON items FOR EACH ROW {_apply('NEW', 1, dialect)}",
+        f"CREATE TRIGGER item_stats_delete AFTER DELETE ON items FOR EACH ROW {_apply('OLD', -1, dialect)}",
+        "CREATE TRIGGER item_stats_update AFTER UPDATE ON items FOR EACH ROW "
+        f"BEGIN IF NOT (OLD.price <=> NEW.price) THEN {_apply('OLD', -1, dialect)}; {_apply('NEW', 1, dialect)}; END IF; END",
+    )
+
+def _installed_triggers(conn, dialect):
+    if dialect == "sqlite":
+        query = text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'items'")
+    else:
+        query = text("SELECT trigger_name FROM information_schema.triggers WHERE event_object_table = 'items'")
+    return set(conn.execute(query).scalars())
+
+def _scan(conn):
+    """Per-bucket (count, sum) straight from the items table"""
+    bucket = _bucket_expr(models.Item.price).label("bucket")
+    query = select(bucket, func.count(), func.coalesce(func.sum(models.Item.price), 0.0)).group_by(bucket)
+    return {row[0]: (row[1], row[2]) for row in conn.execute(query)}
+
+def _stored(conn, for_update=False):
+    query = select(models.ItemPriceBucket).order_by(models.ItemPriceBucket.bucket, models.ItemPriceBucket.stripe)
+    if for_update:
+        query = query.with_for_update()
+    return conn.execute(query).all()
+
+def _totals(rows):
+    """Per-bucket (count, sum) of stored rows, stripes added up"""
+    totals = {}
+    for row in rows:
+        count, total = totals.get(row.bucket, (0, 0.0))
+        totals[row.bucket] = (count + row.item_count, total + row.price_sum)
+    return totals
+
+def _rewrite(conn, scanned, stripes):
+    conn.execute(delete(models.ItemPriceBucket))
+    rows = []
+    for bucket, bound in [(-1, None), *enumerate(_bounds())]:
+        count, total = scanned.get(bucket, (0, 0.0))
+        for stripe in range(stripes):
+            # The scanned totals go to stripe 0; the other stripes start from zero
+            rows.append({
+                "bucket": bucket,
+                "stripe": stripe,
+                "upper_bound": bound,
+                "item_count": count if stripe == 0 else 0,
+                "price_sum": total if stripe == 0 else 0.0,
+            })
+    conn.execute(insert(models.ItemPriceBucket), rows)
+
+def _layout(rows):
+    """(upper bounds, stripes per bucket) of the stored rows"""
+    bounds = {row.bucket: row.upper_bound for row in rows if row.bucket >= 0}
+    stripes = {row.stripe for row in rows}
+    if len(rows) != (len(bounds) + 1) * len(stripes):
+        return None
+    return [bounds[bucket] for bucket in sorted(bounds)], len(stripes)
+
+def ensure_aggregates(engine):
+    """Install the triggers and rebuild the histogram if they are missing or the buckets were reconfigured"""
+    dialect = engine.dialect.name
+    if dialect not in ("sqlite", "mysql"):
+        return
+    table = models.ItemPriceBucket.__table__
+    if "stripe" not in {column["name"] for column in inspect(engine).get_columns(table.name)}:
+        # Created before buckets were striped; the rows are rebuilt from a scan below anyway
+        with engine.begin() as conn:
+            table.drop(conn)
+            table.create(conn)
+    with engine.begin() as conn:
+        layout = _layout(_stored(conn))
+        if layout == (_bounds(), _stripes(dialect)) and _installed_triggers(conn, dialect).issuperset(TRIGGERS):
+            return
+        for name in TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        for statement in _trigger_ddl(dialect):
+            conn.execute(text(statement))
+        _rewrite(conn, _scan(conn), _stripes(dialect))
+
+def rebuild(conn, dry_run=False):
+    """Compare the aggregates with a full scan and, unless dry_run, replace them; returns the drift found"""
+    # Locking the bucket rows first holds off writers' triggers until the scan and rewrite commit
+    stored = _totals(_stored(conn, for_update=not dry_run))
+    if not stored:
+        raise StatsUnavailable("Item statistics are not maintained on this database")
+    scanned = _scan(conn)
+    drift = {}
+    for bucket in sorted(set(stored) | set(scanned)):
+        count, total = stored.get(bucket, (0, 0.0))
+        actual_count, actual_total = scanned.get(bucket, (0, 0.0))
+        # Sums are floats updated one row at a time, so allow for rounding drift
+        if count != actual_count or abs(total - actual_total) > 1e-6 * max(1.0, abs(actual_total)):
+            drift[bucket] = {"stored_count": count, "actual_count": actual_count, "stored_sum": total, "actual_sum": actual_total}
+    if not dry_run:
+        _rewrite(conn, scanned, _stripes(conn.dialect.name))
+    return drift
+
+def read_stats(db):
+    """Totals and histogram from the bucket rows, with min/max read off the ends of the price index"""
+    table = models.ItemPriceBucket
+    min_price = select(func.min(models.Item.price)).scalar_subquery()
+    max_price = select(func.max(models.Item.price)).scalar_subquery()
+    rows = db.execute(
+        select(
+            table.bucket,
+            table.upper_bound,
+            func.sum(table.item_count).label("item_count"),
+            func.sum(table.price_sum).label("price_sum"),
+            min_price.label("min_price"),
+            max_price.label("max_price"),
+        )
+        .group_by(table.bucket, table.upper_bound)
+        .order_by(table.bucket)
+    ).all()
+    if not rows:
+        raise StatsUnavailable("Item statistics are not maintained on this database")
+    # MySQL sums come back as Decimal
+    buckets = [(row.bucket, row.upper_bound, int(row.item_count), float(row.price_sum)) for row in rows]
+    priced = sum(count for bucket, _, count, _ in buckets if bucket >= 0)
+    price_sum = sum(total for bucket, _, _, total in buckets if bucket >= 0)
+    return {
+        "count": sum(count for _, _, count, _ in buckets),
+        "priced": priced,
+        "min_price": rows[0].min_price,
+        "max_price": rows[0].max_price,
+        "avg_price": price_sum / priced if priced else None,
+        "histogram": [{"lt": bound, "count": count} for bucket, bound, count, _ in buckets if bucket >= 0],
+    }
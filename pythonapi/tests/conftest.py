@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# The app reads its configuration at import time, so it is set before any test imports main:
+# a throwaway SQLite file, and every statement over a route's query budget raised as an error
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ["QUERY_GUARD"] = "raise"
+os.environ.setdefault("CACHE_BACKEND", "memory")
+
+# The app's modules import each other by bare name, as when it is started from pythonapi/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def app():
+    import main
+    return main.app
+
+@pytest.fixture(scope="session")
+def client(app):
+    from fastapi.testclient import TestClient
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def cold_cache():
+    from cache import item_cache
+    item_cache.clear()
+    yield item_cache
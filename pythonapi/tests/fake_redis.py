@@ -0,0 +1,66 @@
+import fnmatch
+import threading
+import time
+
+class FakeRedis:
+    """In-process stand-in for the redis-py client calls the caches make: get, set (nx/xx/px), delete, scan_iter, info, transaction"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+        self.evicted_keys = 0
+
+    def _value(self, name):
+        # Caller holds the lock
+        entry = self._data.get(name)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[name]
+            return None
+        return entry
+
+    def get(self, name):
+        with self._lock:
+            entry = self._value(name)
+            return None if entry is None else entry[0]
+
+    def set(self, name, value, nx=False, xx=False, px=None):
+        with self._lock:
+            exists = self._value(name) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+            if isinstance(value, str):
+                value = value.encode()
+            self._data[name] = (value, None if px is None else time.monotonic() + px / 1000)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match="*"):
+        with self._lock:
+            names = [name for name in list(self._data) if self._value(name) is not None]
+        return iter(name for name in names if fnmatch.fnmatchcase(name, match))
+
+    def info(self, section=None):
+        return {"evicted_keys": self.evicted_keys}
+
+    def transaction(self, func, *watches):
+        # Holding the lock for the whole callback is what WATCH/MULTI/EXEC guarantees at best
+        with self._lock:
+            func(_Pipeline(self))
+
+class _Pipeline:
+    """Pipeline in the immediate-execution mode redis-py hands to transaction() callbacks"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, name):
+        return self.client.get(name)
+
+    def multi(self):
+        pass
+
+    def set(self, *args, **kwargs):
+        return self.client.set(*args, **kwargs)
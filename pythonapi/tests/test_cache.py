@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+import pytest
+from sqlalchemy.util.concurrency import greenlet_spawn
+from cache import LRUCache, NullCache, RedisCache
+from fake_redis import FakeRedis
+
+TOMBSTONE_SECONDS = 0.05
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request):
+    if request.param == "memory":
+        return LRUCache(maxsize=10, ttl=60, tombstone_ttl=TOMBSTONE_SECONDS)
+    return RedisCache(client=FakeRedis(), ttl=60, tombstone_ttl=TOMBSTONE_SECONDS)
+
+def item(version):
+    return {"id": 1, "name": f"v{version}", "version": version}
+
+def test_get_returns_what_set_stored(cache):
+    assert cache.get(1) is None
+    cache.set(1, item(1))
+    assert cache.get(1) == item(1)
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+def test_fill_never_replaces_a_cached_entry(cache):
+    cache.fill(1, item(2), 2)
+    cache.fill(1, item(1), 1)
+    assert cache.get(1) == item(2)
+
+def test_stale_fill_after_update_is_refused(cache):
+    # A reader loads version 1, a writer commits version 2 and invalidates, then the reader fills
+    cache.set(1, item(1))
+    cache.invalidate(1, 2)
+    assert cache.get(1) is None
+    cache.fill(1, item(1), 1)
+    assert cache.get(1) is None
+    cache.fill(1, item(2), 2)
+    assert cache.get(1) == item(2)
+
+def test_fill_after_delete_is_refused(cache):
+    cache.invalidate(1)
+    cache.fill(1, item(5), 5)
+    assert cache.get(1) is None
+
+def test_tombstone_expires(cache):
+    cache.set(1, item(1))
+    cache.invalidate(1)
+    time.sleep(TOMBSTONE_SECONDS * 2)
+    cache.fill(1, item(2), 2)
+    assert cache.get(1) == item(2)
+
+def test_delete_and_clear(cache):
+    cache.set(1, item(1))
+    cache.set(2, item(1))
+    cache.delete(1)
+    assert cache.get(1) is None
+    cache.clear()
+    assert len(cache) == 0
+
+def test_entries_expire_after_ttl():
+    cache = RedisCache(client=FakeRedis(), ttl=0.05)
+    cache.set(1, item(1))
+    time.sleep(0.1)
+    assert cache.get(1) is None
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set(1, item(1))
+    cache.set(2, item(1))
+    cache.get(1)
+    cache.set(3, item(1))
+    assert cache.get(2) is None and cache.get(1) is not None
+    assert cache.stats()["evictions"] == 1
+
+def test_null_cache_stores_nothing():
+    cache = NullCache()
+    cache.set(1, item(1))
+    cache.fill(1, item(1), 1)
+    cache.invalidate(1)
+    assert cache.get(1) is None
+
+def test_redis_calls_under_run_sync_leave_the_event_loop():
+    # As the item handlers run under DB_ASYNC: inside AsyncSession.run_sync's greenlet, on the loop thread
+    threads = []
+
+    class ThreadRecordingRedis(FakeRedis):
+        def get(self, name):
+            threads.append(threading.get_ident())
+            return super().get(name)
+
+    cache = RedisCache(client=ThreadRecordingRedis(), ttl=60)
+    cache.set(1, item(1))
+
+    async def run():
+        return threading.get_ident(), await greenlet_spawn(cache.get, 1)
+
+    loop_thread, value = asyncio.run(run())
+    assert value == item(1) and threads and loop_thread not in threads
+    # Called from an ordinary thread it stays a plain blocking call
+    cache.get(1)
+    assert threads[-1] == threading.get_ident()
@@ -0,0 +1,38 @@
+import json
+import pytest
+from sqlalchemy import create_engine, insert
+import export
+import models
+
+def make_shard(tmp_path, name, ids):
+    engine = create_engine(f"sqlite:///{tmp_path / name}")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if ids:
+            conn.execute(insert(models.Item.__table__), [{"id": i, "name": f"item {i}", "price": 1.0} for i in ids])
+    return engine
+
+def test_shards_are_merged_by_id(tmp_path):
+    shards = [make_shard(tmp_path, "a.db", [1, 4, 5, 9]), make_shard(tmp_path, "b.db", [2, 3, 7]), make_shard(tmp_path, "c.db", [])]
+    chunks = list(export.iter_merged_row_chunks(shards, chunk_rows=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [row[0] for chunk in chunks for row in chunk] == [1, 2, 3, 4, 5, 7, 9]
+    lines = "".join(export.iter_ndjson(shards, chunk_rows=2)).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2, 3, 4, 5, 7, 9]
+
+@pytest.mark.parametrize("ids", [[1, 2, 3, 4, 5, 6], [1, 2, 3, 4, 5, 6, 8]])
+def test_keyset_pages_without_a_streaming_cursor(tmp_path, monkeypatch, ids):
+    # As on mysql+mysqlconnector, whose results are always buffered whole
+    monkeypatch.setattr(export, "_streams", lambda engine: False)
+    chunks = list(export.iter_row_chunks(make_shard(tmp_path, "keyset.db", ids), chunk_rows=3))
+    assert [[row[0] for row in chunk] for chunk in chunks] == [ids[i:i + 3] for i in range(0, len(ids), 3)]
+
+def test_record_batches_are_bounded_without_a_streaming_cursor(tmp_path, monkeypatch):
+    if not export.arrow_available():
+        pytest.skip("needs pyarrow")
+    monkeypatch.setattr(export, "_streams", lambda engine: False)
+    engine = make_shard(tmp_path, "batches.db", range(1, 11))
+    # Each batch is built from one id page of batch_rows, never from the whole table
+    batches = list(export.iter_record_batches(engine, batch_rows=4))
+    assert [batch.num_rows for batch in batches] == [4, 4, 2]
+    assert [batch.column(0).to_pylist() for batch in batches] == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
@@ -0,0 +1,56 @@
+import threading
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from fake_redis import FakeRedis
+import idempotency
+
+class ThreadRecordingRedis(FakeRedis):
+    """FakeRedis that notes which thread each call came from"""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def get(self, name):
+        self.threads.add(threading.get_ident())
+        return super().get(name)
+
+    def set(self, name, value, **kwargs):
+        self.threads.add(threading.get_ident())
+        return super().set(name, value, **kwargs)
+
+    def delete(self, *names):
+        self.threads.add(threading.get_ident())
+        return super().delete(*names)
+
+@pytest.fixture
+def redis_app(monkeypatch):
+    client = ThreadRecordingRedis()
+    monkeypatch.setattr(idempotency, "store", idempotency.RedisStore(client=client, ttl=60, prefix="idempotency:"))
+    app = FastAPI()
+    calls = []
+
+    @app.post("/items/")
+    def create():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    return app, client, calls
+
+def test_redis_calls_stay_off_the_event_loop(redis_app):
+    app, redis, calls = redis_app
+    loop_threads = set()
+
+    @app.middleware("http")
+    async def note_loop_thread(request, call_next):
+        loop_threads.add(threading.get_ident())
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        headers = {"Idempotency-Key": "off-loop"}
+        first = client.post("/items/", json={}, headers=headers)
+        replay = client.post("/items/", json={}, headers=headers)
+    assert replay.headers["idempotent-replayed"] == "true" and replay.json() == first.json() and len(calls) == 1
+    assert redis.threads and not redis.threads & loop_threads
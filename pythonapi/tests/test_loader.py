@@ -0,0 +1,59 @@
+import csv
+import pytest
+from types import SimpleNamespace
+from sqlalchemy import create_engine, func, select
+import loader
+import models
+
+ROWS = "id,name,description,price\n1,a,,1\n2,b,,x\n3,c,,3\n4,,,4\n3,dup,,5\n6,f,,6\n"
+
+@pytest.fixture(params=["arrow", "csv"])
+def chunks(request, tmp_path, monkeypatch):
+    if request.param == "arrow" and not loader.arrow_available():
+        pytest.skip("pyarrow is not installed")
+    if request.param == "csv":
+        monkeypatch.setattr(loader, "arrow_available", lambda: False)
+    path = tmp_path / "items.csv"
+    path.write_text(ROWS)
+    return lambda keep_ids: loader.iter_chunks(str(path), chunk_rows=2, keep_ids=keep_ids)
+
+def make_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'load.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+def test_rejects_are_written_per_chunk(tmp_path, chunks):
+    path = tmp_path / "rejects.csv"
+    with loader.RejectWriter(str(path)) as rejects:
+        loaded, rejected, _ = loader.load(make_engine(tmp_path), chunks(False), on_rejects=rejects.write)
+    assert (loaded, rejected, rejects.count) == (4, 2, 2)
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["row", "error", "id", "name", "description", "price"]
+    assert [(row[0], row[1].split(":")[0], row[2]) for row in rows[1:]] == [("2", "price", "2"), ("4", "name", "4")]
+
+def test_duplicate_id_names_the_failed_rows(tmp_path, chunks):
+    engine = make_engine(tmp_path)
+    with pytest.raises(loader.LoadError, match="rows 5-6: .*the 2 rows loaded before them stay committed"):
+        loader.load(engine, chunks(True))
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(models.Item)) == 2
+
+class LoadDataConnection:
+    """Answers LOAD DATA as MySQL does for LOCAL files: the duplicate is skipped with a warning"""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+        if str(statement).startswith("SHOW WARNINGS"):
+            return [("Warning", 1062, "Duplicate entry '3' for key 'items.PRIMARY'")]
+        return SimpleNamespace(rowcount=1)
+
+def test_load_data_reports_skipped_rows():
+    conn = LoadDataConnection()
+    rows = [{"id": 3, "name": "a", "description": None, "price": 1.0}, {"id": 3, "name": "b", "description": None, "price": 2.0}]
+    with pytest.raises(loader.LoadError, match="stored 1 of 2 rows: Duplicate entry '3'"):
+        loader.load_data_infile(conn, rows, list(rows[0]))
+    assert "CHARACTER SET utf8mb4" in conn.statements[0]
@@ -0,0 +1,180 @@
+import json
+import pytest
+from fastapi.routing import APIRoute
+import export
+from multiget import MULTIGET_CHUNK_SIZE, MULTIGET_MAX_IDS
+from query_guard import QueryBudgetExceeded
+
+# Every route runs under QUERY_GUARD=raise (see conftest.py): going over a route's
+# @query_budget, or repeating one statement shape N+1 style, fails the request with
+# QueryBudgetExceeded, which the test client re-raises into the test
+
+SEED_ROWS = MULTIGET_MAX_IDS + 10
+
+@pytest.fixture(scope="module")
+def ids(client):
+    rows = [{"name": f"widget {i}", "description": "blue" if i % 2 else None, "price": float(i % 50)} for i in range(SEED_ROWS)]
+    response = client.post("/items/bulk", json=rows)
+    assert response.status_code == 200
+    return response.json()["ids"]
+
+def test_root(client):
+    assert client.get("/").status_code == 200
+
+def test_guard_is_active(client, ids, cold_cache, monkeypatch):
+    route = next(route for route in client.app.routes if isinstance(route, APIRoute) and route.path == "/items/{item_id}")
+    monkeypatch.setattr(route.endpoint, "query_budget", 0)
+    with pytest.raises(QueryBudgetExceeded):
+        client.get(f"/items/{ids[0]}")
+
+def test_create_read_update_delete(client, cold_cache):
+    created = client.post("/items/", json={"name": "gadget", "price": 3.5})
+    assert created.status_code == 200
+    item_id = created.json()["id"]
+
+    first = client.get(f"/items/{item_id}")
+    assert first.status_code == 200
+    # Served from the cache, then revalidated from it
+    assert client.get(f"/items/{item_id}").json() == first.json()
+    assert client.get(f"/items/{item_id}", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    updated = client.put(f"/items/{item_id}", json={"name": "gadget", "price": 4.0}, headers={"If-Match": first.headers["etag"]})
+    assert updated.status_code == 200
+    # The lost compare-and-swap reads the current version to tell a conflict from a missing row
+    lost = client.put(f"/items/{item_id}", json={"name": "gadget", "price": 5.0}, headers={"If-Match": first.headers["etag"]})
+    assert lost.status_code == 409
+    assert client.get(f"/items/{item_id}").json()["version"] == 2
+
+    assert client.delete(f"/items/{item_id}").status_code == 200
+    assert client.delete(f"/items/{item_id}").status_code == 404
+    assert client.put(f"/items/{item_id}", json={"name": "gadget", "price": 1.0}).status_code == 404
+    assert client.get(f"/items/{item_id}").status_code == 404
+
+def test_read_item_uncached_paths(client, ids, cold_cache):
+    item_id = ids[1]
+    assert client.get(f"/items/{item_id}?fields=name,price").json().keys() == {"id", "name", "price"}
+    etag = client.get(f"/items/{item_id}").headers["etag"]
+    cold_cache.clear()
+    # Version-only query, then the 304
+    assert client.get(f"/items/{item_id}", headers={"If-None-Match": etag}).status_code == 304
+    cold_cache.clear()
+    # Version-only query that does not match, then the full row
+    assert client.get(f"/items/{item_id}", headers={"If-None-Match": '"0-0"'}).status_code == 200
+
+def test_pages(client, ids):
+    page = client.get("/items/", params={"limit": 50})
+    assert page.status_code == 200 and len(page.json()) == 50
+    assert client.get("/items/", params={"limit": 50}, headers={"If-None-Match": page.headers["etag"]}).status_code == 304
+    following = client.get("/items/", params={"limit": 50, "cursor": page.headers["x-next-cursor"]})
+    assert following.json()[0]["id"] == page.json()[-1]["id"] + 1
+    assert client.get("/items/", params={"skip": 100, "limit": 20}).status_code == 200
+    by_price = client.get("/items/", params={"sort": "price", "limit": 30})
+    assert client.get("/items/", params={"sort": "price", "limit": 30, "cursor": by_price.headers["x-next-cursor"]}).status_code == 200
+    assert client.get("/items/", params={"fields": "name", "limit": 5}).json()[0].keys() == {"id", "name"}
+    assert client.get("/items/", params={"cursor": "garbage"}).status_code == 400
+
+@pytest.mark.parametrize("fields", [None, "name,price"])
+def test_multiget_over_several_chunks(client, ids, cold_cache, fields):
+    # The most ids a request may name, over several IN chunks: one statement each, all in the route's budget
+    assert MULTIGET_MAX_IDS > MULTIGET_CHUNK_SIZE
+    wanted = ids[: MULTIGET_MAX_IDS - 1] + [10**9]
+    params = {"ids": ",".join(map(str, wanted)), **({"fields": fields} if fields else {})}
+    response = client.get("/items/", params=params)
+    assert response.status_code == 200
+    assert len(response.json()) == len(wanted) - 1
+    assert response.headers["x-missing-ids"] == str(10**9)
+    assert client.get("/items/", params=params, headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+def test_multiget_from_cache(client, ids, cold_cache):
+    params = {"ids": ",".join(map(str, ids[:20]))}
+    client.get("/items/", params=params)
+    assert len(client.get("/items/", params=params).json()) == 20
+    assert client.get("/items/", params={"ids": "1,x"}).status_code == 400
+
+def test_bulk_ndjson_and_errors(client):
+    body = "\n".join(json.dumps({"name": f"line {i}", "price": 1.0}) for i in range(5))
+    response = client.post("/items/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.json()["count"] == 5
+    assert client.post("/items/bulk", content=b'[{"name": x}]', headers={"Content-Type": "application/json"}).status_code == 400
+    assert client.post("/items/bulk", json=[{"name": "no price"}]).status_code == 422
+
+def test_idempotent_create(client):
+    headers = {"Idempotency-Key": "budget-test"}
+    first = client.post("/items/", json={"name": "once", "price": 1.0}, headers=headers)
+    replay = client.post("/items/", json={"name": "once", "price": 1.0}, headers=headers)
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.json() == first.json()
+
+def test_search(client, ids):
+    found = client.get("/items/search", params={"q": "widg", "limit": 10})
+    assert found.status_code == 200 and len(found.json()) == 10
+    assert client.get("/items/search", params={"q": "widg", "cursor": found.headers["x-next-cursor"]}).status_code == 200
+    assert client.get("/items/search", params={"q": "blue", "fields": "name"}).json()[0].keys() == {"id", "name"}
+    assert client.get("/items/search", params={"q": "!!"}).status_code == 400
+
+def test_stats(client, ids):
+    stats = client.get("/items/stats").json()
+    assert stats["count"] >= SEED_ROWS
+    rebuilt = client.post("/items/stats/rebuild", params={"dry_run": True}).json()
+    assert rebuilt["consistent"]
+    assert client.post("/items/stats/rebuild").status_code == 200
+
+def test_changes(client, ids):
+    feed = client.get("/items/changes", params={"limit": 100}).json()
+    assert len(feed["changes"]) == 100
+    following = client.get("/items/changes", params={"since": feed["next_since"], "limit": 10}).json()
+    assert following["changes"][0]["seq"] == feed["next_since"] + 1
+    latest = client.get("/items/changes", params={"since": 10**9, "wait": 0.05}).json()
+    assert latest == {"changes": [], "next_since": 10**9}
+
+@pytest.mark.parametrize("format", sorted(export.FORMATS))
+def test_export(client, ids, format):
+    if format in export.COLUMNAR_FORMATS and not export.arrow_available():
+        pytest.skip("needs pyarrow")
+    response = client.get("/items/export", params={"format": format})
+    assert response.status_code == 200 and response.content
+
+def test_operational_routes(client):
+    assert client.get("/pool/stats").json()["primary"]["size"] >= 1
+    assert "hits" in client.get("/cache/stats").json()
+    assert client.get("/metrics").status_code == 200
+
+# One request per route, each run under the guard like the tests above
+ROUTE_REQUESTS = {
+    "GET /": lambda client, item_id: client.get("/"),
+    "POST /items/bulk": lambda client, item_id: client.post("/items/bulk", json=[{"name": "bulk", "price": 1.0}]),
+    "GET /metrics": lambda client, item_id: client.get("/metrics"),
+    "GET /pool/stats": lambda client, item_id: client.get("/pool/stats"),
+    "GET /cache/stats": lambda client, item_id: client.get("/cache/stats"),
+    "GET /items/export": lambda client, item_id: client.get("/items/export"),
+    "GET /items/stats": lambda client, item_id: client.get("/items/stats"),
+    "POST /items/stats/rebuild": lambda client, item_id: client.post("/items/stats/rebuild", params={"dry_run": True}),
+    "GET /items/search": lambda client, item_id: client.get("/items/search", params={"q": "route"}),
+    "GET /items/changes": lambda client, item_id: client.get("/items/changes", params={"limit": 5}),
+    "POST /items/": lambda client, item_id: client.post("/items/", json={"name": "route", "price": 1.0}),
+    "GET /items/{item_id}": lambda client, item_id: client.get(f"/items/{item_id}"),
+    "GET /items/": lambda client, item_id: client.get("/items/", params={"limit": 5}),
+    "PUT /items/{item_id}": lambda client, item_id: client.put(f"/items/{item_id}", json={"name": "route", "price": 2.0}),
+    "DELETE /items/{item_id}": lambda client, item_id: client.delete(f"/items/{item_id}"),
+}
+
+def test_every_route_is_exercised(app, client, monkeypatch):
+    # Each route records the requests it handles, so nothing depends on other tests or on /metrics
+    served = set()
+    routes = {}
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            for method in route.methods:
+                routes[f"{method} {route.path}"] = route
+
+            def record(scope, receive, send, route=route, handle=route.app):
+                served.add(f'{scope["method"]} {route.path}')
+                return handle(scope, receive, send)
+            monkeypatch.setattr(route, "app", record)
+
+    item_id = client.post("/items/", json={"name": "route", "price": 1.0}).json()["id"]
+    for name, send in ROUTE_REQUESTS.items():
+        response = send(client, item_id)
+        assert response.status_code < 400, (name, response.status_code)
+    assert set(routes) - set(ROUTE_REQUESTS) == set(), "add the new routes to ROUTE_REQUESTS"
+    assert set(routes) - served == set()
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import create_engine, insert
+import items
+import models
+import sharding
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch, cold_cache):
+    # Two SQLite shards swapped in under the already-imported app
+    engines = [create_engine(f"sqlite:///{tmp_path / f'shard{i}.db'}") for i in range(2)]
+    for shard in engines:
+        models.Base.metadata.create_all(bind=shard)
+    monkeypatch.setattr(sharding, "shard_engines", engines)
+    monkeypatch.setattr(sharding, "SHARD_COUNT", len(engines))
+    monkeypatch.setattr(items, "SHARDED", True)
+    return engines
+
+def test_multiget_with_nothing_to_fetch(client, shards, cold_cache):
+    assert sharding.scatter_ids([], lambda db, ids: ids) == []
+    assert client.get("/items/", params={"ids": ""}).json() == []
+    for item_id in (1, 2):
+        cold_cache.fill(item_id, {"id": item_id, "name": f"cached {item_id}", "description": None, "price": 1.0, "version": 1}, 1)
+    response = client.get("/items/", params={"ids": "1,2"})
+    assert response.status_code == 200 and [item["name"] for item in response.json()] == ["cached 1", "cached 2"]
+
+def test_multiget_reads_only_the_owning_shards(client, shards, cold_cache):
+    item_id = 10**6
+    with sharding.engine_for(item_id).begin() as conn:
+        conn.execute(insert(models.Item.__table__), [{"id": item_id, "name": "on a shard", "price": 2.0}])
+    response = client.get("/items/", params={"ids": f"{item_id},{item_id + 1}"})
+    assert [item["name"] for item in response.json()] == ["on a shard"]
+    assert response.headers["x-missing-ids"] == str(item_id + 1)
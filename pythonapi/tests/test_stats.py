@@ -0,0 +1,54 @@
+from sqlalchemy import create_engine, insert, text, update
+import models
+import stats
+
+def make_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    return engine
+
+def add_items(engine, prices):
+    with engine.begin() as conn:
+        conn.execute(insert(models.Item.__table__), [{"name": f"item {i}", "price": price} for i, price in enumerate(prices)])
+
+def test_triggers_keep_the_histogram_current(tmp_path):
+    engine = make_engine(tmp_path)
+    add_items(engine, [0.5, 3.0])
+    stats.ensure_aggregates(engine)
+    add_items(engine, [3.5, None, 2000.0])
+    with engine.begin() as conn:
+        conn.execute(update(models.Item).where(models.Item.price == 0.5).values(price=7.0))
+    with engine.connect() as conn:
+        result = stats.read_stats(conn)
+        assert stats.rebuild(conn, dry_run=True) == {}
+    assert (result["count"], result["priced"], result["min_price"], result["max_price"]) == (5, 4, 3.0, 2000.0)
+    assert [bucket["count"] for bucket in result["histogram"]] == [0, 2, 1, 0, 0, 0, 0, 0, 0, 1]
+
+def test_stripes_are_summed(tmp_path):
+    engine = make_engine(tmp_path)
+    add_items(engine, [3.0, 4.0])
+    stats.ensure_aggregates(engine)
+    with engine.begin() as conn:
+        # As MySQL writers on other connections would have left it: the bucket spread over stripes
+        stats._rewrite(conn, stats._scan(conn), 4)
+        table = models.ItemPriceBucket
+        conn.execute(update(table).where(table.bucket == 1, table.stripe == 0).values(item_count=1, price_sum=3.0))
+        conn.execute(update(table).where(table.bucket == 1, table.stripe == 3).values(item_count=1, price_sum=4.0))
+    with engine.connect() as conn:
+        result = stats.read_stats(conn)
+        assert stats.rebuild(conn, dry_run=True) == {}
+    assert result["histogram"][1]["count"] == 2 and result["avg_price"] == 3.5
+
+def test_unstriped_table_is_rebuilt(tmp_path):
+    engine = make_engine(tmp_path)
+    add_items(engine, [3.0])
+    with engine.begin() as conn:
+        # The layout before stripes were added
+        conn.execute(text("DROP TABLE item_price_buckets"))
+        conn.execute(text(
+            "CREATE TABLE item_price_buckets (bucket INTEGER PRIMARY KEY, upper_bound FLOAT, item_count INTEGER NOT NULL, price_sum FLOAT NOT NULL)"
+        ))
+    stats.ensure_aggregates(engine)
+    add_items(engine, [4.0])
+    with engine.connect() as conn:
+        assert stats.read_stats(conn)["histogram"][1]["count"] == 2